@@ -1,15 +1,19 @@
 """This module primarily functions as a script that connects to the database and
-dispatches a request to the scan queue for each domain and scan type.
+dispatches scan requests for every domain and scan type to the scan queue in batches.
 
 Needs environment variables (see below for list) seeded from a secret in the cluster to function.
 """
 import os
 import sys
+import time
 import logging
-import requests
 import datetime
 import traceback
-from arango import ArangoClient
+from collections import deque
+from itertools import islice
+from concurrent.futures import Future, ThreadPoolExecutor
+from database import get_db
+from dispatcher import AsyncDispatcher
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
@@ -19,58 +23,204 @@ DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 DB_HOST = os.getenv("DB_HOST")
 QUEUE_URL = os.getenv("SCAN_QUEUE_URL", "http://scan-queue.scanners.svc.cluster.local")
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "500"))
+CURSOR_BATCH_SIZE = int(os.getenv("CURSOR_BATCH_SIZE", "1000"))
+CURSOR_TTL = int(os.getenv("CURSOR_TTL", "600"))
+COUNT_DOMAINS = os.getenv("COUNT_DOMAINS", "true").lower() == "true"
+PROGRESS_INTERVAL = int(os.getenv("PROGRESS_INTERVAL", "10000"))
+# "all" dispatches every domain, "staleness" the least recently scanned first
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "all")
+SCAN_BUDGET = int(os.getenv("SCAN_BUDGET", "0"))
+SCAN_RATE = float(os.getenv("SCAN_RATE", "0"))
+SCAN_SLA = float(os.getenv("SCAN_SLA", "48"))
 
+DOMAINS_QUERY = """
+FOR domain IN domains
+  RETURN {"_key": domain._key, "domain": domain.domain, "selectors": domain.selectors}
+"""
+
+# Domains that were never scanned have no lastRan, which sorts first
+STALEST_DOMAINS_QUERY = """
+FOR domain IN domains
+  SORT domain.lastRan
+  LIMIT @budget
+  RETURN {"_key": domain._key, "domain": domain.domain, "selectors": domain.selectors}
+"""
+
+OVERDUE_COUNT_QUERY = """
+FOR domain IN domains
+  FILTER domain.lastRan < @cutoff
+  COLLECT WITH COUNT INTO overdue
+  RETURN overdue
+"""
+
+# A domain deleted since it was read is skipped rather than failing the batch
+STAMP_LAST_RAN_QUERY = """
+FOR key IN @keys
+  UPDATE {"_key": key, "lastRan": @scan_time} IN domains
+  OPTIONS { ignoreErrors: true }
+"""
 
-def dispatch_https(domain, client):
-    """This function dispatches a scan request to the HTTPS scanner
+
+def scan_requests(domain):
+    """Builds the HTTPS, SSL and DNS scan requests for a domain
 
     :param dict domain: A domain obtained from the DB's domains collection.
-    :param requests client: HTTP client used to post the payload to the queue.
-    :return: nothing
-    :rtype: None
+    :return: scan requests in the form the scan queue's /bulk route expects
+    :rtype: list
     """
     payload = {
         "domain_key": domain["_key"],
         "domain": domain["domain"],
         "uuid": None,
     }
-    client.post(QUEUE_URL + "/https", json=payload)
+    return [
+        {"scan_type": "https", "payload": payload},
+        {"scan_type": "ssl", "payload": payload},
+        {
+            "scan_type": "dns",
+            "payload": {**payload, "selectors": domain.get("selectors", None)},
+        },
+    ]
 
 
-def dispatch_ssl(domain, client):
-    """This function dispatches a scan request to the SSL scanner
+def dispatch_batch(domains, client):
+    """This function dispatches the scan requests for a batch of domains in one request
 
-    :param dict domain: A domain obtained from the DB's domains collection.
-    :param requests client: HTTP client used to post the payload to the queue.
-    :return: nothing
-    :rtype: None
+    :param list domains: Domains obtained from the DB's domains collection.
+    :param client: HTTP client used to post the payload to the queue.
+    :return: the client's response, or for an AsyncDispatcher a future of whether the request succeeded
     """
-    payload = {
-        "domain_key": domain["_key"],
-        "domain": domain["domain"],
-        "uuid": None,
-    }
-    client.post(QUEUE_URL + "/ssl", json=payload)
+    payload = []
+    for domain in domains:
+        payload.extend(scan_requests(domain))
+    return client.post(QUEUE_URL + "/bulk", json=payload)
 
 
-def dispatch_dns(domain, client):
-    """This function dispatches a scan request to the DNS scanner
+def stamp_last_ran(db, domains, scan_time):
+    """This function updates the 'lastRan' timestamp of a batch of domains in a single query
 
-    :param dict domain: A domain obtained from the DB's domains collection.
-    :param requests client: HTTP client used to post the payload to the queue.
+    :param db: Database the domains are stored in.
+    :param list domains: Domains obtained from the DB's domains collection.
+    :param str scan_time: Timestamp to store as each domain's 'lastRan'.
     :return: nothing
     :rtype: None
     """
-    payload = {
-        "domain_key": domain["_key"],
-        "domain": domain["domain"],
-        "selectors": domain.get("selectors", None),
-        "uuid": None,
-    }
-    client.post(QUEUE_URL + "/dns", json=payload)
+    db.aql.execute(
+        STAMP_LAST_RAN_QUERY,
+        bind_vars={"keys": [domain["_key"] for domain in domains], "scan_time": scan_time},
+    )
+
 
+def stamp_if_dispatched(db, domains, scan_time, response):
+    """This function updates the 'lastRan' timestamp of a batch of domains once the scan queue has accepted its scan requests
 
-def scan(db_host, db_port, db_name, user_name, password, http_client=requests):
+    :param db: Database the domains are stored in.
+    :param list domains: Domains obtained from the DB's domains collection.
+    :param str scan_time: Timestamp to store as each domain's 'lastRan'.
+    :param response: What dispatch_batch returned for the batch, waited on if it's a future.
+    :return: whether the batch was accepted and stamped
+    :rtype: bool
+    """
+    if isinstance(response, Future):
+        accepted = response.result()
+    else:
+        accepted = response is not None and response.ok
+    if not accepted:
+        logging.warning(
+            f"Scan requests for {len(domains)} domains were not accepted, their 'lastRan' is left unchanged."
+        )
+        return False
+    stamp_last_ran(db, domains, scan_time)
+    return True
+
+
+def cursor_ttl(rate):
+    """Seconds a domains cursor must stay open between fetches
+
+    :param float rate: Target domains per minute, 0 when dispatch isn't paced.
+    :return: CURSOR_TTL, or twice the time a paced run takes to dispatch a cursor batch if that's longer
+    :rtype: int
+    """
+    if rate <= 0:
+        return CURSOR_TTL
+    return max(CURSOR_TTL, int(2 * CURSOR_BATCH_SIZE / rate * 60))
+
+
+def batches(domains, batch_size):
+    """Splits an iterable of domains into lists of batch_size domains, without reading ahead
+
+    :param domains: Domains to split.
+    :param int batch_size: Number of domains per batch.
+    :return: A generator of batches.
+    :rtype: generator
+    """
+    domains = iter(domains)
+    while True:
+        batch = list(islice(domains, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def select_stalest(db, budget, sla, ttl=CURSOR_TTL):
+    """Selects the least recently scanned domains, raising the budget if it
+    can't keep every domain within the SLA
+
+    :param db: Database the domains are stored in.
+    :param int budget: Number of domains to select unless more are overdue, 0 for every domain.
+    :param float sla: Hours within which every domain should be rescanned.
+    :param int ttl: Seconds the cursor stays open between fetches.
+    :return: A cursor over the selected domains, and how many there are.
+    :rtype: tuple
+    """
+    # Sorting on the index reads only as many domains as the budget allows.
+    # Building it is slow on a large collection, so it's only created once
+    collection = db.collection("domains")
+    if not any(
+        index["type"] == "persistent" and index["fields"] == ["lastRan"]
+        for index in collection.indexes()
+    ):
+        logging.info("Creating index on 'lastRan'...")
+        collection.add_persistent_index(fields=["lastRan"])
+
+    total = collection.count()
+    if budget <= 0 or budget > total:
+        budget = total
+
+    cutoff = str(datetime.datetime.utcnow() - datetime.timedelta(hours=sla))
+    overdue = next(db.aql.execute(OVERDUE_COUNT_QUERY, bind_vars={"cutoff": cutoff}))
+    if overdue > budget:
+        logging.warning(
+            f"{overdue} domains were last scanned more than {sla} hours ago, raising the budget of {budget} to dispatch all of them."
+        )
+        budget = overdue
+    else:
+        logging.info(f"{overdue} domains were last scanned more than {sla} hours ago.")
+
+    domains = db.aql.execute(
+        STALEST_DOMAINS_QUERY,
+        bind_vars={"budget": budget},
+        batch_size=CURSOR_BATCH_SIZE,
+        ttl=ttl,
+        stream=True,
+    )
+    return domains, budget
+
+
+def scan(
+    db_host,
+    db_port,
+    db_name,
+    user_name,
+    password,
+    http_client=None,
+    batch_size=SCAN_BATCH_SIZE,
+    mode=SCHEDULER_MODE,
+    budget=SCAN_BUDGET,
+    rate=SCAN_RATE,
+    sla=SCAN_SLA,
+):
     """Uses credentials provided to queue scans for all domains in the Tracker DB
 
     :param str db_host: DB host name.
@@ -78,43 +228,87 @@ def scan(db_host, db_port, db_name, user_name, password, http_client=requests):
     :param str db_name: Name of the DB to connect to.
     :param str user_name: Username to connect to DB with.
     :param str password: Password to connect to DB with.
-    :param requests http_client: HTTP client to supply to dispatch functions, defaults to requests
+    :param http_client: HTTP client to supply to dispatch functions, defaults to a new AsyncDispatcher
+    :param int batch_size: Number of domains dispatched per request to the scan queue
+    :param str mode: "all" to scan every domain, "staleness" to scan the least recently scanned first
+    :param int budget: Number of domains scanned in "staleness" mode unless more are past the SLA, 0 for every domain
+    :param float rate: Target domains per minute, 0 to dispatch as fast as possible
+    :param float sla: Hours within which every domain should be rescanned in "staleness" mode
     :return: count of domains scans were dispatched for
     :rtype: int
     """
     logging.info("Retrieving domains for scheduled scan...")
+    count = 0
+    # Batches are sent concurrently unless a client is supplied
+    dispatcher = None
+    if http_client is None:
+        dispatcher = AsyncDispatcher()
+        http_client = dispatcher
     try:
-        # Establish DB connection
-        connection_string = f"http://{db_host}:{db_port}"
-        arango_client = ArangoClient(hosts=connection_string)
-        db = arango_client.db(db_name, username=user_name, password=password)
+        db = get_db(db_host, db_port, db_name, user_name, password)
 
         logging.info("Querying domains...")
 
-        domains = db.collection("domains").all()
+        # A paced run fetches from the cursor less often, so it's kept open longer
+        ttl = cursor_ttl(rate)
+        if mode == "staleness":
+            domains, total = select_stalest(db, budget, sla, ttl=ttl)
+        else:
+            # Counting is a cheap metadata lookup, only used to report progress
+            total = db.collection("domains").count() if COUNT_DOMAINS else None
+
+            # Only the fields needed for the scan requests are streamed, a
+            # batch at a time, so memory use doesn't grow with the number of
+            # domains
+            domains = db.aql.execute(
+                DOMAINS_QUERY,
+                batch_size=CURSOR_BATCH_SIZE,
+                ttl=ttl,
+                stream=True,
+            )
 
         scan_time = str(datetime.datetime.utcnow())
-        count = 0
+        started = time.monotonic()
 
-        for domain in domains:
-            count = count + 1
-            logging.info(f"Dispatching scan number {count} of {len(domains)}")
-            logging.info(f"Requesting scan for {domain['domain']}")
+        # Each batch's 'lastRan' timestamps are updated in the background once
+        # the scan queue accepts it, while the next batches are dispatched
+        max_pending = getattr(http_client, "max_in_flight", 0) + 2
+        with ThreadPoolExecutor(max_workers=1) as stamper:
+            stamps = deque()
+            for batch in batches(domains, batch_size):
+                response = dispatch_batch(batch, http_client)
+                stamps.append(
+                    stamper.submit(stamp_if_dispatched, db, batch, scan_time, response)
+                )
+                previous_count = count
+                count = count + len(batch)
+                if count // PROGRESS_INTERVAL > previous_count // PROGRESS_INTERVAL:
+                    logging.info(f"Dispatched scans for {count} of {total or 'unknown'} domains")
 
-            # Update the 'lastRan' timestamp on the domain being scanned
-            db.collection("domains").update_match(
-                {"_key": domain["_key"]}, {"lastRan": scan_time}
-            )
+                # Finished updates are checked as they complete, and dispatch
+                # waits if updates fall more than a couple of batches behind
+                # the requests in flight
+                while stamps and (stamps[0].done() or len(stamps) > max_pending):
+                    stamps.popleft().result()
+
+                # Batches are spaced out so the scanners get a steady load
+                if rate > 0:
+                    delay = started + count / rate * 60 - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
 
-            dispatch_https(domain, http_client)
-            dispatch_ssl(domain, http_client)
-            dispatch_dns(domain, http_client)
+            # Raises if any batch failed to update
+            for stamp in stamps:
+                stamp.result()
 
     except Exception as e:
         logging.error(
             f"An unexpected error occurred while initiating scheduled scan: {str(e)}\n\nFull traceback: {traceback.format_exc()}"
         )
-        return count - 1
+        return count
+    finally:
+        if dispatcher is not None:
+            logging.info(f"Dispatch report: {dispatcher.close()}")
     logging.info("Domains have been dispatched for scanning.")
     return count
 
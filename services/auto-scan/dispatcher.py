@@ -0,0 +1,120 @@
+"""Concurrent HTTP dispatch of scan requests to the scan queue.
+
+An asyncio event loop runs in a background thread with one aiohttp session,
+so connections to the queue are kept alive and reused. Callers post from
+ordinary synchronous code: posting returns as soon as the request is
+handed to the loop, and blocks only while the cap on in-flight requests is
+reached.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import aiohttp
+
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "8"))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+
+
+class AsyncDispatcher:
+    """HTTP client with the same post(url, json) interface as requests,
+    sending requests concurrently.
+
+    :param int max_in_flight: Maximum number of requests awaiting a response.
+    :param float timeout: Seconds each request may take before it counts as failed.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, timeout=REQUEST_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.latencies = []
+        self.failures = 0
+        self.futures = []
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.session = asyncio.run_coroutine_threadsafe(
+            self._create_session(), self.loop
+        ).result()
+        self.started = time.monotonic()
+
+    async def _create_session(self):
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def _post(self, url, payload):
+        started = time.monotonic()
+        try:
+            async with self.session.post(url, json=payload) as response:
+                await response.read()
+                response.raise_for_status()
+            self.latencies.append(time.monotonic() - started)
+            return True
+        except Exception as e:
+            self.failures = self.failures + 1
+            logging.error(
+                f"Request to {url} failed after {time.monotonic() - started:.2f}s: ({type(e).__name__}: {str(e)})"
+            )
+            return False
+        finally:
+            self.slots.release()
+
+    def post(self, url, json):
+        """Sends a JSON POST request without waiting for its response.
+
+        :param str url: URL to post to.
+        :param json: JSON serializable payload.
+        :return: A future of whether the request succeeded, which completes once the response is received.
+        :rtype: concurrent.futures.Future
+        """
+        self.slots.acquire()
+        future = asyncio.run_coroutine_threadsafe(self._post(url, json), self.loop)
+        # Finished requests are dropped so only in-flight ones are kept
+        self.futures = [pending for pending in self.futures if not pending.done()]
+        self.futures.append(future)
+        return future
+
+    def close(self):
+        """Waits for every request to finish, then closes the connections.
+
+        :return: The throughput and latency report.
+        :rtype: dict
+        """
+        for future in self.futures:
+            future.result()
+        self.futures = []
+        elapsed = time.monotonic() - self.started
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        """Summarizes the requests sent.
+
+        :param float elapsed: Seconds since the dispatcher was created.
+        :return: Request and failure counts, requests per second and latency percentiles in seconds.
+        :rtype: dict
+        """
+        latencies = sorted(self.latencies)
+        requests = len(latencies) + self.failures
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))], 4)
+
+        return {
+            "requests": requests,
+            "failures": self.failures,
+            "elapsed": round(elapsed, 3),
+            "requests_per_second": round(requests / elapsed, 2) if elapsed > 0 else None,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": round(latencies[-1], 4) if latencies else None,
+        }
@@ -30,3 +30,94 @@ def test_dispatch():
     dispatched = scan("testdb", 8529, "test", "", "", http_client=client_stub)
 
     assert dispatched == len(input_domains)
+
+
+def test_dispatch_batches():
+    db = arango_client.db("test", username="", password="")
+    posted = []
+    client_stub = stub(post=lambda url, json: posted.append((url, json)) or stub(ok=True))
+
+    dispatched = scan("testdb", 8529, "test", "", "", http_client=client_stub, batch_size=2)
+
+    assert dispatched == db.collection("domains").count()
+    assert [len(payload) for url, payload in posted] == [6, 3]
+    assert all(url.endswith("/bulk") for url, payload in posted)
+    assert {request["scan_type"] for request in posted[0][1]} == {"https", "ssl", "dns"}
+    assert all(domain.get("lastRan") for domain in db.collection("domains").all())
+
+
+def test_dispatch_leaves_rejected_batches_unstamped():
+    db = arango_client.db("test", username="", password="")
+    last_ran = {domain["_key"]: domain["lastRan"] for domain in db.collection("domains").all()}
+    client_stub = stub(post=lambda url, json: stub(ok=False))
+
+    dispatched = scan("testdb", 8529, "test", "", "", http_client=client_stub, batch_size=2)
+
+    assert dispatched == len(last_ran)
+    assert {
+        domain["_key"]: domain["lastRan"] for domain in db.collection("domains").all()
+    } == last_ran
+
+
+def test_dispatch_stalest_within_budget():
+    db = arango_client.db("test", username="", password="")
+    now = datetime.datetime.utcnow()
+    for number, domain in enumerate(db.collection("domains").all()):
+        db.collection("domains").update(
+            {
+                "_key": domain["_key"],
+                "lastRan": str(now - datetime.timedelta(hours=number + 1)),
+            }
+        )
+    stalest = sorted(db.collection("domains").all(), key=lambda domain: domain["lastRan"])
+    posted = []
+    client_stub = stub(post=lambda url, json: posted.append(json) or stub(ok=True))
+
+    dispatched = scan(
+        "testdb",
+        8529,
+        "test",
+        "",
+        "",
+        http_client=client_stub,
+        batch_size=10,
+        mode="staleness",
+        budget=2,
+    )
+
+    assert dispatched == 2
+    assert {request["payload"]["domain_key"] for request in posted[0]} == {
+        domain["_key"] for domain in stalest[:2]
+    }
+    assert any(
+        index["fields"] == ["lastRan"] for index in db.collection("domains").indexes()
+    )
+
+
+def test_dispatch_stalest_raises_budget_for_overdue_domains():
+    db = arango_client.db("test", username="", password="")
+    now = datetime.datetime.utcnow()
+    for number, domain in enumerate(db.collection("domains").all()):
+        db.collection("domains").update(
+            {
+                "_key": domain["_key"],
+                "lastRan": str(now - datetime.timedelta(hours=number + 1)),
+            }
+        )
+    client_stub = stub(post=lambda url, json: stub(ok=True))
+
+    # Two domains were last scanned more than 1.5 hours ago
+    dispatched = scan(
+        "testdb",
+        8529,
+        "test",
+        "",
+        "",
+        http_client=client_stub,
+        batch_size=10,
+        mode="staleness",
+        budget=1,
+        sla=1.5,
+    )
+
+    assert dispatched == 2
@@ -0,0 +1,60 @@
+import json
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dispatcher import AsyncDispatcher
+
+
+@pytest.fixture
+def queue_server():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            if self.path == "/slow":
+                time.sleep(1)
+            received.append(json.loads(body))
+            self.send_response(500 if self.path == "/error" else 200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", received
+    server.shutdown()
+
+
+def test_dispatcher_sends_every_request(queue_server):
+    url, received = queue_server
+    dispatcher = AsyncDispatcher(max_in_flight=2, timeout=5)
+
+    for number in range(10):
+        dispatcher.post(url + "/bulk", json=[{"number": number}])
+    report = dispatcher.close()
+
+    assert sorted(payload[0]["number"] for payload in received) == list(range(10))
+    assert report["requests"] == 10
+    assert report["failures"] == 0
+    assert report["latency_p50"] <= report["latency_max"]
+
+
+def test_dispatcher_counts_failures_and_timeouts(queue_server):
+    url, received = queue_server
+    dispatcher = AsyncDispatcher(max_in_flight=2, timeout=0.5)
+
+    responses = [
+        dispatcher.post(url + "/error", json=[]),
+        dispatcher.post(url + "/slow", json=[]),
+        dispatcher.post(url + "/bulk", json=[]),
+    ]
+    report = dispatcher.close()
+
+    assert [response.result() for response in responses] == [False, False, True]
+    assert report["requests"] == 3
+    assert report["failures"] == 2
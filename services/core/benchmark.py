@@ -0,0 +1,142 @@
+"""Times core's stages against whatever dataset is loaded, e.g. one from synthetic_data.py.
+
+Each stage is run on its own, in the order given, through run_stages so it
+is measured by the same StageMetrics as a production run. The report
+includes domain throughput and can be saved and compared against an earlier
+run's report.
+
+Usage::
+
+    python3 benchmark.py --stages summaries history --repeat 3 --output after.json --compare before.json
+"""
+import json
+import argparse
+import statistics
+import core
+
+STAGES = {
+    "guidance": core.sync_guidance,
+    "scan_summaries": core.update_scan_summaries,
+    "chart_summaries": core.update_chart_summaries,
+    "org_summaries": core.update_org_summaries,
+    "summaries": core.update_summaries,
+    "incremental_summaries": core.update_summaries_incremental,
+    "criteria_summaries": core.update_criteria_summaries,
+    "history": core.record_summary_history,
+}
+
+
+def run_benchmark(stages, repeat=1, db=None):
+    """Runs each stage repeat times and reports the median of its metrics.
+
+    :param list stages: Names of stages in STAGES.
+    :param int repeat: Number of runs of each stage.
+    :param db: Database the stages run against, used to count domains.
+    :return: The report, keyed by stage name.
+    :rtype: dict
+    """
+    domain_count = db.collection("domains").count() if db is not None else None
+    report = {"domains": domain_count, "stages": {}}
+    for stage_name in stages:
+        runs = []
+        for _ in range(repeat):
+            result = core.run_stages({stage_name: (STAGES[stage_name], [])}, workers=1)[
+                stage_name
+            ]
+            if result["status"] != "completed":
+                raise RuntimeError(f"Stage {stage_name} failed: {result['error']}")
+            runs.append(result["metrics"].as_dict())
+
+        summary = {
+            field: statistics.median(run[field] for run in runs)
+            for field in runs[0]
+            if field != "stage" and runs[0][field] is not None
+        }
+        summary["runs"] = len(runs)
+        if domain_count and summary["wall_time"] > 0:
+            summary["domains_per_second"] = round(domain_count / summary["wall_time"], 1)
+        report["stages"][stage_name] = summary
+    return report
+
+
+def compare_reports(report, baseline):
+    """Change of each stage's median metrics relative to a baseline report.
+
+    :return: Ratio of new to old value, keyed by stage and metric.
+    :rtype: dict
+    """
+    changes = {}
+    for stage_name, summary in report["stages"].items():
+        old = baseline["stages"].get(stage_name)
+        if old is None:
+            continue
+        changes[stage_name] = {
+            field: round(value / old[field], 3)
+            for field, value in summary.items()
+            if field != "runs" and old.get(field)
+        }
+    return changes
+
+
+def format_report(report, changes=None):
+    columns = [
+        "wall_time",
+        "db_requests",
+        "docs_read",
+        "docs_written",
+        "bytes_received",
+        "domains_per_second",
+    ]
+    lines = [
+        f"{report['domains']} domains",
+        "stage".ljust(24) + "".join(column.rjust(20) for column in columns),
+    ]
+    for stage_name, summary in report["stages"].items():
+        lines.append(
+            stage_name.ljust(24)
+            + "".join(str(summary.get(column, "")).rjust(20) for column in columns)
+        )
+        # Ratios to the baseline, below 1 is an improvement for all but throughput
+        if changes and stage_name in changes:
+            stage_changes = changes[stage_name]
+            lines.append(
+                "  vs baseline".ljust(24)
+                + "".join(
+                    (f"x{stage_changes[column]}" if column in stage_changes else "").rjust(20)
+                    for column in columns
+                )
+            )
+    return "\n".join(lines)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=list(STAGES),
+        default=["summaries"],
+        help="Stages to time, in order.",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of each stage.")
+    parser.add_argument("--output", help="Write the report as JSON to this path.")
+    parser.add_argument("--compare", help="Compare against a report written by --output.")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    db = core.get_db(core.DB_HOST, core.DB_PORT, core.DB_NAME, core.DB_USER, core.DB_PASS)
+    report = run_benchmark(args.stages, repeat=args.repeat, db=db)
+
+    changes = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            changes = compare_reports(report, json.load(baseline_file))
+        report["baseline"] = args.compare
+        report["changes"] = changes
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    print(format_report(report, changes))
@@ -8,9 +8,23 @@ import traceback
 import emoji
 import random
 import datetime
-from arango import ArangoClient
+import hashlib
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from gql import gql, Client
 from gql.transport.requests import RequestsHTTPTransport
+from arango.exceptions import ArangoServerError
+import tracemalloc
+from database import get_db, add_request_observer
+from stage_metrics import (
+    StageMetrics,
+    record,
+    record_request,
+    counted,
+    write_prometheus_textfile,
+)
+from status_matrix import StatusMatrix
+from summary_criteria import SummaryCriteria
 
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
@@ -21,81 +35,499 @@ REPO_NAME = os.getenv("REPO_NAME")
 REPO_OWNER = os.getenv("REPO_OWNER")
 GUIDANCE_DIR = os.getenv("GUIDANCE_DIR")
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+GUIDANCE_SOURCE = os.getenv("GUIDANCE_SOURCE", "github")
+# Where app/jobs/core-local-guidance-job.yaml mounts the guidance ConfigMap
+GUIDANCE_PATH = os.getenv("GUIDANCE_PATH", "/guidance")
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "1000"))
+CURSOR_BATCH_SIZE = int(os.getenv("CURSOR_BATCH_SIZE", "1000"))
+CURSOR_TTL = int(os.getenv("CURSOR_TTL", "600"))
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "full")
+SUMMARY_SOURCE = os.getenv("SUMMARY_SOURCE", "status")
+FULL_RECOMPUTE_INTERVAL = int(os.getenv("FULL_RECOMPUTE_INTERVAL", "168"))
+CORE_WORKERS = int(os.getenv("CORE_WORKERS", "4"))
+PARTITION_COUNT = int(os.getenv("PARTITION_COUNT", "1"))
+PARTITION_INDEX = int(os.getenv("PARTITION_INDEX", os.getenv("JOB_COMPLETION_INDEX", "0")))
+PARTITION_RUN_ID = os.getenv("PARTITION_RUN_ID")
+# Identifies a run across retries of the same job, so a retry can resume it
+RUN_ID = os.getenv("RUN_ID")
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", "1000"))
+SKIP_UNCHANGED = os.getenv("SKIP_UNCHANGED", "true").lower() == "true"
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE")
+TRACEMALLOC = os.getenv("TRACEMALLOC", "false").lower() == "true"
+# Days each resolution of summary history is kept for, 0 keeps it forever
+HISTORY_RETENTION = {
+    "run": int(os.getenv("HISTORY_RUN_DAYS", "7")),
+    "day": int(os.getenv("HISTORY_DAY_DAYS", "90")),
+    "week": int(os.getenv("HISTORY_WEEK_DAYS", "730")),
+    "month": int(os.getenv("HISTORY_MONTH_DAYS", "0")),
+}
 
 SCAN_TYPES = ["https", "ssl", "dkim", "spf", "dmarc"]
 CHARTS = {"mail": ["dmarc", "spf", "dkim"], "web": ["https", "ssl"]}
+ROLLUP_TYPES = ["zone", "sector"]
+SCAN_COLLECTIONS = [
+    "https",
+    "ssl",
+    "dmarc",
+    "spf",
+    "dkim",
+    "dkimResults",
+    "domainsHTTPS",
+    "domainsSSL",
+    "domainsDMARC",
+    "domainsSPF",
+    "domainsDKIM",
+    "dkimToDkimResults",
+]
+
+# Every domain is counted once per scan type; statuses other than "pass" or
+# "fail" only contribute to the total.
+SCAN_SUMMARY_QUERY = """
+FOR domain IN domains
+  FOR scanType IN @scan_types
+    COLLECT type = scanType AGGREGATE
+      passCount = SUM(domain.status[scanType] == "pass" ? 1 : 0),
+      failCount = SUM(domain.status[scanType] == "fail" ? 1 : 0),
+      total = LENGTH(1)
+    RETURN {"_key": type, "pass": passCount, "fail": failCount, "total": total}
+"""
+
+# Only the scan statuses summaries are built from leave the server
+DOMAIN_STATUS_QUERY = """
+FOR domain IN domains
+  RETURN {"_id": domain._id, "status": KEEP(domain.status, @scan_types)}
+"""
+
+ORG_QUERY = """
+FOR org IN organizations
+  FILTER org._key > @after
+  SORT org._key
+  RETURN {
+    "_id": org._id,
+    "_key": org._key,
+    "summaries": KEEP(org.summaries, ATTRIBUTES(@charts)),
+    "zone": org.orgDetails.en.zone,
+    "sector": org.orgDetails.en.sector
+  }
+"""
+
+ORG_ROLLUP_QUERY = """
+FOR org IN organizations
+  FILTER org._id IN @org_ids
+  RETURN {"_id": org._id, "zone": org.orgDetails.en.zone, "sector": org.orgDetails.en.sector}
+"""
+
+REMOVE_STALE_ROLLUPS_QUERY = """
+FOR rollup IN summaryRollups
+  FILTER rollup._key NOT IN @keys
+  REMOVE rollup IN summaryRollups
+"""
+
+APPLY_ROLLUP_DELTAS_QUERY = """
+FOR delta IN @deltas
+  UPSERT {"_key": delta._key}
+    INSERT delta
+    UPDATE {
+      "summaries": MERGE(
+        FOR chartType IN ATTRIBUTES(delta.summaries)
+          LET summary = OLD.summaries[chartType]
+          LET change = delta.summaries[chartType]
+          RETURN {
+            [chartType]: {
+              "pass": summary.pass + change.pass,
+              "fail": summary.fail + change.fail,
+              "total": summary.total + change.total
+            }
+          }
+      )
+    }
+  IN summaryRollups
+"""
+
+# An organization's chart only passes for a claimed domain if every one of the
+# chart's scan types passed
+ORG_SUMMARY_QUERY = """
+WITH domains
+FOR org IN organizations
+  LET statuses = (
+    FOR domain IN 1..1 OUTBOUND org claims
+      RETURN domain.status
+  )
+  LET total = LENGTH(statuses)
+  LET summaries = MERGE(
+    FOR chartType IN ATTRIBUTES(@charts)
+      LET passCount = LENGTH(
+        FOR status IN statuses
+          FILTER (FOR scanType IN @charts[chartType] RETURN status[scanType]) ALL == "pass"
+          RETURN 1
+      )
+      RETURN {[chartType]: {"pass": passCount, "fail": total - passCount, "total": total}}
+  )
+  FILTER KEEP(org.summaries, ATTRIBUTES(@charts)) != summaries
+  RETURN {"_key": org._key, "summaries": summaries}
+"""
+
+CLAIM_QUERY = """
+FOR claim IN claims
+  RETURN {"_from": claim._from, "_to": claim._to}
+"""
+
+GUIDANCE_STATE_QUERY = """
+FOR doc IN @@collection
+  RETURN UNSET(doc, "_id", "_rev")
+"""
+
+# Domains and claims are partitioned on a hash of the domain key (the low 16
+# bits of its CRC32), so each claim lands in the same partition as its domain
+PARTITION_DOMAIN_STATUS_QUERY = """
+FOR domain IN domains
+  LET checksum = UPPER(CRC32(domain._key))
+  LET bucket = SUM(
+    FOR i IN 1..4
+      RETURN FIND_FIRST("0123456789ABCDEF", SUBSTRING(checksum, LENGTH(checksum) - i, 1)) * POW(16, i - 1)
+  )
+  FILTER bucket % @partition_count == @partition
+  RETURN {"_id": domain._id, "status": KEEP(domain.status, @scan_types)}
+"""
+
+PARTITION_CLAIM_QUERY = """
+FOR claim IN claims
+  LET checksum = UPPER(CRC32(PARSE_IDENTIFIER(claim._to).key))
+  LET bucket = SUM(
+    FOR i IN 1..4
+      RETURN FIND_FIRST("0123456789ABCDEF", SUBSTRING(checksum, LENGTH(checksum) - i, 1)) * POW(16, i - 1)
+  )
+  FILTER bucket % @partition_count == @partition
+  RETURN {"_from": claim._from, "_to": claim._to}
+"""
+
+SUMMARY_PARTIALS_QUERY = """
+FOR partial IN summaryPartials
+  FILTER partial.run == @run
+  RETURN partial
+"""
+
+REMOVE_SUMMARY_PARTIALS_QUERY = """
+FOR partial IN summaryPartials
+  FILTER partial.run == @run
+  REMOVE partial IN summaryPartials
+"""
+
+CRITERIA_QUERY = """
+FOR criteria IN @@collection
+  RETURN {"_key": criteria._key, "pass": criteria.pass, "fail": criteria.fail}
+"""
+
+# Every guidance tag the criteria refer to from each domain's latest scan of
+# each type; DKIM tags come from every selector's result of the latest scan
+DOMAIN_TAGS_QUERY = """
+WITH domains, https, ssl, dmarc, spf, dkim, dkimResults
+FOR domain IN domains
+  LET httpsScan = FIRST(
+    FOR scan IN 1..1 OUTBOUND domain domainsHTTPS
+      SORT scan.timestamp DESC
+      LIMIT 1
+      RETURN scan
+  )
+  LET sslScan = FIRST(
+    FOR scan IN 1..1 OUTBOUND domain domainsSSL
+      SORT scan.timestamp DESC
+      LIMIT 1
+      RETURN scan
+  )
+  LET dmarcScan = FIRST(
+    FOR scan IN 1..1 OUTBOUND domain domainsDMARC
+      SORT scan.timestamp DESC
+      LIMIT 1
+      RETURN scan
+  )
+  LET spfScan = FIRST(
+    FOR scan IN 1..1 OUTBOUND domain domainsSPF
+      SORT scan.timestamp DESC
+      LIMIT 1
+      RETURN scan
+  )
+  LET dkimScan = FIRST(
+    FOR scan IN 1..1 OUTBOUND domain domainsDKIM
+      SORT scan.timestamp DESC
+      LIMIT 1
+      RETURN scan
+  )
+  LET dkimResults = dkimScan == null ? [] : (
+    FOR result IN 1..1 OUTBOUND dkimScan dkimToDkimResults
+      RETURN result
+  )
+  LET tags = FLATTEN(
+    FOR scan IN APPEND([httpsScan, sslScan, dmarcScan, spfScan], dkimResults)
+      FILTER scan != null
+      RETURN APPEND(
+        APPEND(scan.guidanceTags || [], scan.negativeTags || []),
+        APPEND(scan.positiveTags || [], scan.neutralTags || [])
+      )
+  )
+  RETURN INTERSECTION(UNIQUE(tags), @tags)
+"""
+
+# Domains whose scan statuses or claiming organizations differ from the
+# snapshot taken the last time they were counted towards the summaries
+STATUS_CHANGE_QUERY = """
+FOR domain IN domains
+  LET status = KEEP(domain.status, @scan_types)
+  LET orgs = (
+    FOR claim IN claims
+      FILTER claim._to == domain._id
+      RETURN claim._from
+  )
+  LET snapshot = DOCUMENT("summaryStatuses", domain._key)
+  FILTER snapshot == null
+    OR snapshot.status != status
+    OR SORTED(snapshot.orgs) != SORTED(orgs)
+  RETURN {
+    "_key": domain._key,
+    "old": snapshot == null ? null : {"status": snapshot.status, "orgs": snapshot.orgs},
+    "new": {"status": status, "orgs": orgs}
+  }
+"""
+
+# Domains that were counted towards the summaries but have since been removed
+REMOVED_STATUS_QUERY = """
+FOR snapshot IN summaryStatuses
+  FILTER DOCUMENT("domains", snapshot._key) == null
+  RETURN {
+    "_key": snapshot._key,
+    "old": {"status": snapshot.status, "orgs": snapshot.orgs},
+    "new": null
+  }
+"""
+
+APPLY_SUMMARY_DELTAS_QUERY = """
+FOR delta IN @deltas
+  UPSERT {"_key": delta._key}
+    INSERT {"_key": delta._key, "pass": delta.pass, "fail": delta.fail, "total": delta.total}
+    UPDATE {
+      "pass": OLD.pass + delta.pass,
+      "fail": OLD.fail + delta.fail,
+      "total": OLD.total + delta.total
+    }
+  IN @@collection
+"""
+
+APPLY_ORG_SUMMARY_DELTAS_QUERY = """
+FOR delta IN @deltas
+  LET org = DOCUMENT(delta._id)
+  FILTER org != null
+  UPDATE org WITH {
+    "summaries": MERGE(
+      FOR chartType IN ATTRIBUTES(delta.summaries)
+        LET summary = org.summaries[chartType]
+        LET change = delta.summaries[chartType]
+        RETURN {
+          [chartType]: {
+            "pass": summary.pass + change.pass,
+            "fail": summary.fail + change.fail,
+            "total": summary.total + change.total
+          }
+        }
+    )
+  } IN organizations
+"""
+
+REMOVE_STALE_STATUSES_QUERY = """
+FOR snapshot IN summaryStatuses
+  FILTER snapshot.summarizedAt != @summarized_at
+  REMOVE snapshot IN summaryStatuses
+"""
+
+SUMMARY_HISTORY_QUERY = """
+FOR summary IN @@collection
+  RETURN {
+    "subject": @subject,
+    "chart": summary._key,
+    "pass": summary.pass,
+    "fail": summary.fail,
+    "total": summary.total
+  }
+"""
+
+NESTED_SUMMARY_HISTORY_QUERY = """
+FOR doc IN @@collection
+  FOR chartType IN ATTRIBUTES(NOT_NULL(doc.summaries, {}))
+    LET summary = doc.summaries[chartType]
+    RETURN {
+      "subject": doc._id,
+      "chart": chartType,
+      "pass": summary.pass,
+      "fail": summary.fail,
+      "total": summary.total
+    }
+"""
+
+REMOVE_EXPIRED_HISTORY_QUERY = """
+FOR entry IN summaryHistory
+  FILTER entry.resolution == @resolution AND entry.time < @before
+  REMOVE entry IN summaryHistory
+"""
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
+# Database requests are attributed to the stage that made them
+add_request_observer(record_request)
 
-def retrieve_guidance(
-    token=GITHUB_TOKEN, owner=REPO_OWNER, repo=REPO_NAME, directory=GUIDANCE_DIR
-):
-    logging.info(f"Retrieving guidance...")
 
-    gh_client = Client(
+def github_client(token=GITHUB_TOKEN):
+    # The schema is never fetched; it's only needed for client-side validation
+    return Client(
         transport=RequestsHTTPTransport(
             url="https://api.github.com/graphql",
             headers={"Authorization": "bearer " + token},
         ),
-        fetch_schema_from_transport=True,
+        fetch_schema_from_transport=False,
     )
 
-    guidance = []
 
+def retrieve_guidance_oid(
+    token=GITHUB_TOKEN, owner=REPO_OWNER, repo=REPO_NAME, directory=GUIDANCE_DIR
+):
     # fmt: off
-    guidance_files_query = """
+    guidance_oid_query = """
     {{
       repository(name: "{REPO_NAME}", owner: "{REPO_OWNER}") {{
-        id
         object(expression: "master:{GUIDANCE_DIR}") {{
           ... on Tree {{
-            entries {{
-                name
-            }}
+            oid
           }}
         }}
       }}
     }}
     """.format(**{"REPO_NAME": repo, "REPO_OWNER": owner, "GUIDANCE_DIR": directory})
     # fmt: on
-    guidance_files_result = gh_client.execute(gql(guidance_files_query))
-    file_names = []
-
-    for file in guidance_files_result["repository"]["object"]["entries"]:
-        file_names.append(file["name"])
-
-    for file_name in file_names:
-        # fmt: off
-        guidance_query = """
-        {{
-          repository(name: "{REPO_NAME}", owner: "{REPO_OWNER}") {{
-            id
-            object(expression: "master:{GUIDANCE_DIR}/{FILE_NAME}") {{
-              ... on Blob {{
-                text
+    guidance_oid_result = github_client(token).execute(gql(guidance_oid_query))
+
+    return guidance_oid_result["repository"]["object"]["oid"]
+
+
+def retrieve_guidance(
+    token=GITHUB_TOKEN, owner=REPO_OWNER, repo=REPO_NAME, directory=GUIDANCE_DIR
+):
+    logging.info(f"Retrieving guidance...")
+
+    guidance = []
+
+    # Every file's text is fetched alongside the tree listing in one query
+    # fmt: off
+    guidance_query = """
+    {{
+      repository(name: "{REPO_NAME}", owner: "{REPO_OWNER}") {{
+        object(expression: "master:{GUIDANCE_DIR}") {{
+          ... on Tree {{
+            oid
+            entries {{
+              name
+              object {{
+                ... on Blob {{
+                  text
+                }}
               }}
             }}
           }}
         }}
-        """.format(**{"REPO_NAME": repo, "REPO_OWNER": owner, "GUIDANCE_DIR": directory, "FILE_NAME": file_name})
-        # fmt: on
-        guidance_result = gh_client.execute(gql(guidance_query))
+      }}
+    }}
+    """.format(**{"REPO_NAME": repo, "REPO_OWNER": owner, "GUIDANCE_DIR": directory})
+    # fmt: on
+    guidance_result = github_client(token).execute(gql(guidance_query))
+    tree = guidance_result["repository"]["object"]
+
+    for file in tree["entries"]:
         try:
             guidance.append(
-                {
-                    "file": file_name,
-                    "guidance": json.loads(
-                        guidance_result["repository"]["object"]["text"]
-                    ),
-                }
+                {"file": file["name"], "guidance": json.loads(file["object"]["text"])}
             )
-        except KeyError:
+        except (KeyError, TypeError):
             pass
 
     logging.info(f"Guidance retrieved.")
 
-    return guidance
+    return guidance, tree["oid"]
+
+
+def read_guidance_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def load_guidance(path=GUIDANCE_PATH):
+    logging.info(f"Loading guidance from {path}...")
+
+    if not os.path.isdir(path):
+        raise FileNotFoundError(
+            f"Guidance directory {path} not found, mount the guidance there or set GUIDANCE_PATH."
+        )
+
+    # Hidden entries are skipped so ConfigMap mounts (..data) can be read as-is
+    file_names = sorted(
+        file_name
+        for file_name in os.listdir(path)
+        if file_name.endswith(".json")
+        and not file_name.startswith(".")
+        and os.path.isfile(os.path.join(path, file_name))
+    )
+
+    with ThreadPoolExecutor() as executor:
+        texts = list(
+            executor.map(
+                read_guidance_file,
+                [os.path.join(path, file_name) for file_name in file_names],
+            )
+        )
+        parsed = list(executor.map(json.loads, texts))
+
+    # The digest of every file plays the part of the GitHub tree oid
+    digest = hashlib.sha1()
+    for file_name, text in zip(file_names, texts):
+        digest.update(file_name.encode("utf-8"))
+        digest.update(text.encode("utf-8"))
+
+    guidance = [
+        {"file": file_name, "guidance": file_guidance}
+        for file_name, file_guidance in zip(file_names, parsed)
+    ]
+
+    logging.info(f"Guidance loaded.")
+
+    return guidance, digest.hexdigest()
+
+
+def sync_guidance_collection(db, collection, documents):
+    create_collection_if_missing(db, collection)
+
+    # Read the collection's current state once and diff it in memory
+    current = {
+        doc["_key"]: doc
+        for doc in db.aql.execute(
+            GUIDANCE_STATE_QUERY, bind_vars={"@collection": collection}
+        )
+    }
+
+    inserts = [doc for doc in documents if doc["_key"] not in current]
+    updates = [
+        doc
+        for doc in documents
+        if doc["_key"] in current and current[doc["_key"]] != doc
+    ]
+    skipped = len(documents) - len(inserts) - len(updates)
+
+    if inserts:
+        check_write_errors(collection, db.collection(collection).insert_many(inserts))
+    if updates:
+        check_write_errors(collection, db.collection(collection).replace_many(updates))
+    record("docs_written", len(inserts) + len(updates))
+
+    logging.info(
+        f"{collection}: {len(inserts)} inserted, {len(updates)} updated, {skipped} not updated."
+    )
+
+    return {"inserted": len(inserts), "updated": len(updates), "skipped": skipped}
 
 
 def update_guidance(
@@ -103,158 +535,216 @@ def update_guidance(
 ):
     logging.info(f"Updating guidance...")
 
-    # Establish DB connection
-    connection_string = f"http://{host}:{port}"
-    client = ArangoClient(hosts=connection_string)
-    db = client.db(name, username=user, password=password)
+    db = get_db(host, port, name, user, password)
+
+    totals = {"inserted": 0, "updated": 0, "skipped": 0}
 
     for entry in guidance_data:
         if entry["file"] == "scanSummaryCriteria.json":
-            if not db.has_collection("scanSummaryCriteria"):
-                db.create_collection(
-                    name="scanSummaryCriteria",
-                    replication_factor=3,
-                    shard_count=6,
-                    write_concern=1,
-                )
-            for criteria_type, criteria in entry["guidance"].items():
-                new_criteria = {
+            collection = "scanSummaryCriteria"
+            documents = [
+                {
                     "_key": criteria_type,
                     "pass": criteria.get("pass", []),
                     "fail": criteria.get("fail", []),
                     "warning": criteria.get("warning", []),
                     "info": criteria.get("info", []),
                 }
-
-                logging.info(
-                    f"Checking if scan summary criteria {criteria_type} exists..."
-                )
-                current_criteria = db.collection("scanSummaryCriteria").get(
-                    {"_key": criteria_type}
-                )
-
-                criteria_exists = current_criteria is not None
-                criteria_updated = criteria_exists and (
-                    current_criteria != new_criteria
-                )
-
-                # Insert if the criteria doesn't exist
-                if not criteria_exists:
-                    db.collection("scanSummaryCriteria").insert(new_criteria)
-                    logging.info(f"Scan summary criteria {criteria_type} inserted.")
-                # Update if the criteria has changed
-                elif criteria_updated:
-                    db.collection("scanSummaryCriteria").update_match(
-                        {"_key": criteria_type},
-                        {
-                            "pass": criteria.get("pass", []),
-                            "fail": criteria.get("fail", []),
-                            "info": criteria.get("info", []),
-                        },
-                    )
-                    logging.info(f"Scan summary criteria {criteria_type} updated.")
-                else:
-                    logging.info(f"Scan summary criteria {criteria_type} not updated.")
+                for criteria_type, criteria in entry["guidance"].items()
+            ]
 
         elif entry["file"] == "chartSummaryCriteria.json":
-            if not db.has_collection("chartSummaryCriteria"):
-                db.create_collection(
-                    "chartSummaryCriteria",
-                    replication_factor=3,
-                    shard_count=6,
-                    write_concern=1,
-                )
-            for criteria_type, criteria in entry["guidance"].items():
-                new_criteria = {
+            collection = "chartSummaryCriteria"
+            documents = [
+                {
                     "_key": criteria_type,
                     "pass": criteria.get("pass", []),
                     "fail": criteria.get("fail", []),
                 }
+                for criteria_type, criteria in entry["guidance"].items()
+            ]
 
-                logging.info(
-                    f"Checking if chart summary criteria {criteria_type} exists..."
-                )
-                current_criteria = db.collection("chartSummaryCriteria").get(
-                    {"_key": criteria_type}
-                )
-
-                criteria_exists = current_criteria is not None
-                criteria_updated = criteria_exists and (
-                    current_criteria != new_criteria
-                )
-
-                # Insert if the criteria doesn't exist
-                if not criteria_exists:
-                    db.collection("chartSummaryCriteria").insert(new_criteria)
-                    logging.info(f"Chart summary criteria {criteria_type} inserted.")
-                # Update if the criteria has changed
-                elif criteria_updated:
-                    db.collection("chartSummaryCriteria").update_match(
-                        {"_key": criteria_type},
-                        {"pass": criteria.get("pass", []), "fail": criteria.get("fail", [])},
-                    )
-                    logging.info(f"Chart summary criteria {criteria_type} updated.")
-                else:
-                    logging.info(f"Chart summary criteria {criteria_type} not updated.")
-
-        else:
+        elif entry["file"].startswith("tags_") and entry["file"].endswith(".json"):
             file_name = entry["file"].split(".json")[0]
             tag_type = file_name.split("tags_")[1]
-            if not db.has_collection(f"{tag_type}GuidanceTags"):
-                db.create_collection(
-                    f"{tag_type}GuidanceTags",
-                    replication_factor=3,
-                    shard_count=6,
-                    write_concern=1,
-                )
-            for tag_key, tag_data in entry["guidance"].items():
-                new_tag = {
+            collection = f"{tag_type}GuidanceTags"
+            documents = [
+                {
                     "_key": tag_key,
                     "tagName": tag_data["tagName"],
                     "guidance": tag_data["guidance"],
                     "refLinksGuide": tag_data.get("refLinksGuide", None),
                     "refLinksTechnical": tag_data.get("refLinksTechnical", None),
                 }
+                for tag_key, tag_data in entry["guidance"].items()
+            ]
 
-                logging.info(f"Checking if tag {tag_key} exists...")
-                current_tag = db.collection(f"{tag_type}GuidanceTags").get(
-                    {"_key": tag_key}
-                )
+        else:
+            logging.warning(f"Skipping unrecognised guidance file {entry['file']}.")
+            continue
 
-                tag_exists = current_tag is not None
-                tag_updated = tag_exists and (current_tag != new_tag)
-
-                # Insert if the tag doesn't exist
-                if not tag_exists:
-                    db.collection(f"{tag_type}GuidanceTags").insert(new_tag)
-                    logging.info(f"Tag {tag_key} inserted.")
-                # Update if the tag has changed
-                elif tag_updated:
-                    db.collection(f"{tag_type}GuidanceTags").update_match(
-                        {"_key": tag_key},
-                        {
-                            "tagName": tag_data["tagName"],
-                            "guidance": tag_data["guidance"],
-                            "refLinksGuide": tag_data.get("refLinksGuide", None),
-                            "refLinksTechnical": tag_data.get(
-                                "refLinksTechnical", None
-                            ),
-                        },
-                    )
-                    logging.info(f"Tag {tag_key} updated.")
-                else:
-                    logging.info(f"Tag {tag_key} not updated.")
+        counts = sync_guidance_collection(db, collection, documents)
+        for count_type, count in counts.items():
+            totals[count_type] = totals[count_type] + count
 
+    logging.info(
+        f"Guidance writes: {totals['inserted']} inserted, {totals['updated']} updated, {totals['skipped']} skipped."
+    )
     logging.info(f"Guidance update completed.")
 
+    return totals
+
+
+def sync_guidance(
+    host=DB_HOST,
+    name=DB_NAME,
+    user=DB_USER,
+    password=DB_PASS,
+    port=DB_PORT,
+    token=GITHUB_TOKEN,
+    owner=REPO_OWNER,
+    repo=REPO_NAME,
+    directory=GUIDANCE_DIR,
+    source=GUIDANCE_SOURCE,
+    path=GUIDANCE_PATH,
+):
+    db = get_db(host, port, name, user, password)
+
+    # Guidance is pinned to the version it was last synced from (the git tree
+    # oid, or a digest of the local files), so an unchanged version skips the
+    # DB sync and, for GitHub, the file download as well
+    state = get_core_state(db, "guidance")
+    current_version = state.get("version") if state is not None else None
+
+    if source == "local":
+        guidance_data, version = load_guidance(path)
+        if version == current_version:
+            logging.info(f"Guidance unchanged since {version}, skipping update.")
+            return None
+    else:
+        version = retrieve_guidance_oid(token, owner, repo, directory)
+        if version == current_version:
+            logging.info(f"Guidance unchanged since {version}, skipping update.")
+            return None
+        guidance_data, version = retrieve_guidance(token, owner, repo, directory)
+
+    # A failed write raises before the version is stored, so the next run
+    # syncs this version again instead of skipping it
+    writes = update_guidance(guidance_data, host, name, user, password, port)
+    set_core_state(db, "guidance", {"version": version})
+
+    return writes
+
+
+def stream_query(db, query, bind_vars=None, batch_size=None):
+    # Streaming cursors hand results over batch by batch, so neither the
+    # server nor core ever holds a full result set in memory
+    cursor = db.aql.execute(
+        query,
+        bind_vars=bind_vars,
+        batch_size=batch_size or CURSOR_BATCH_SIZE,
+        ttl=CURSOR_TTL,
+        stream=True,
+    )
+    return counted(cursor)
+
+
+def new_summary():
+    return {"pass": 0, "fail": 0, "total": 0}
+
+
+def count_scan_summaries(scan_summaries, status, weight=1):
+    for scan_type, summary in scan_summaries.items():
+        summary["total"] = summary["total"] + weight
+        if status.get(scan_type) == "fail":
+            summary["fail"] = summary["fail"] + weight
+        elif status.get(scan_type) == "pass":
+            summary["pass"] = summary["pass"] + weight
+
+
+def count_chart_summaries(chart_summaries, status, weight=1):
+    # A chart passes unless one of its scan types failed
+    for chart_type, summary in chart_summaries.items():
+        summary["total"] = summary["total"] + weight
+        if any(status.get(scan_type) == "fail" for scan_type in CHARTS[chart_type]):
+            summary["fail"] = summary["fail"] + weight
+        else:
+            summary["pass"] = summary["pass"] + weight
+
+
+def count_org_summaries(org_summaries, status, weight=1):
+    # An organization's chart only passes if every one of its scan types passed
+    for chart_type, summary in org_summaries.items():
+        summary["total"] = summary["total"] + weight
+        if all(status.get(scan_type) == "pass" for scan_type in CHARTS[chart_type]):
+            summary["pass"] = summary["pass"] + weight
+        else:
+            summary["fail"] = summary["fail"] + weight
+
+
+def create_collection_if_missing(db, name):
+    if not db.has_collection(name):
+        db.create_collection(
+            name,
+            replication_factor=3,
+            shard_count=6,
+            write_concern=1,
+        )
+
+
+def check_write_errors(collection, results):
+    # Bulk writes return a failed document's error in its place rather than
+    # raising, so a failure has to be looked for before counting the writes
+    errors = [result for result in results if isinstance(result, ArangoServerError)]
+    if errors:
+        logging.error(
+            f"{len(errors)} of {len(results)} writes to {collection} failed: {errors[0].message}"
+        )
+        raise errors[0]
+
+
+def clear_core_state(db, key):
+    if db.has_collection("coreState"):
+        db.collection("coreState").delete(key, ignore_missing=True)
+
+
+def get_core_state(db, key):
+    if not db.has_collection("coreState"):
+        return None
+    return db.collection("coreState").get({"_key": key})
+
+
+def set_core_state(db, key, state):
+    create_collection_if_missing(db, "coreState")
+    db.collection("coreState").insert({"_key": key, **state}, overwrite=True)
+
+
+def write_org_summaries(db, org_summaries, batch_size=SUMMARY_BATCH_SIZE):
+    # Only the summaries sub-document is sent. A failed write raises so a
+    # checkpointed run can't move on past the organization
+    written = 0
+    batch = []
+    for org_summary in org_summaries:
+        batch.append(org_summary)
+        if len(batch) >= batch_size:
+            db.collection("organizations").update_many(
+                batch, raise_on_document_error=True
+            )
+            written = written + len(batch)
+            batch = []
+    if batch:
+        db.collection("organizations").update_many(
+            batch, raise_on_document_error=True
+        )
+        written = written + len(batch)
+    record("docs_written", written)
+    return written
+
 
 def update_scan_summaries(host=DB_HOST, name=DB_NAME, user=DB_USER, password=DB_PASS, port=DB_PORT):
     logging.info(f"Updating scan summaries...")
 
-    # Establish DB connection
-    connection_string = f"http://{host}:{port}"
-    client = ArangoClient(hosts=connection_string)
-    db = client.db(name, username=user, password=password)
+    db = get_db(host, port, name, user, password)
 
     if not db.has_collection("scanSummaries"):
         db.create_collection(
@@ -264,36 +754,23 @@ def update_scan_summaries(host=DB_HOST, name=DB_NAME, user=DB_USER, password=DB_
             write_concern=1,
         )
 
-    for scan_type in SCAN_TYPES:
-        scan_pass = 0
-        scan_fail = 0
-        scan_total = 0
-        for domain in db.collection("domains"):
-            scan_total = scan_total + 1
-            if domain["status"][scan_type] == "fail":
-                scan_fail = scan_fail + 1
-            elif domain["status"][scan_type] == "pass":
-                scan_pass = scan_pass + 1
-
-        current_summary = db.collection("scanSummaries").get({"_key": scan_type})
-
-        summary_exists = current_summary is not None
+    # Count pass/fail/total for every scan type in a single server-side pass
+    cursor = db.aql.execute(
+        SCAN_SUMMARY_QUERY, bind_vars={"scan_types": SCAN_TYPES}
+    )
+    counts = {summary["_key"]: summary for summary in cursor}
 
-        if not summary_exists:
-            db.collection("scanSummaries").insert(
-                {
-                    "_key": scan_type,
-                    "pass": scan_pass,
-                    "fail": scan_fail,
-                    "total": scan_total,
-                }
-            )
-        else:
-            db.collection("scanSummaries").update_match(
-                {"_key": scan_type},
-                {"pass": scan_pass, "fail": scan_fail, "total": scan_total},
+    summaries = []
+    for scan_type in SCAN_TYPES:
+        summaries.append(
+            counts.get(
+                scan_type, {"_key": scan_type, "pass": 0, "fail": 0, "total": 0}
             )
+        )
 
+    db.collection("scanSummaries").import_bulk(summaries, on_duplicate="update")
+
+    for scan_type in SCAN_TYPES:
         logging.info(f"{scan_type} scan summary updated.")
 
     logging.info(f"Scan summary update completed.")
@@ -302,10 +779,7 @@ def update_scan_summaries(host=DB_HOST, name=DB_NAME, user=DB_USER, password=DB_
 def update_chart_summaries(host=DB_HOST, name=DB_NAME, user=DB_USER, password=DB_PASS, port=DB_PORT):
     logging.info(f"Updating chart summaries...")
 
-    # Establish DB connection
-    connection_string = f"http://{host}:{port}"
-    client = ArangoClient(hosts=connection_string)
-    db = client.db(name, username=user, password=password)
+    db = get_db(host, port, name, user, password)
 
     if not db.has_collection("chartSummaries"):
         db.create_collection(
@@ -315,39 +789,22 @@ def update_chart_summaries(host=DB_HOST, name=DB_NAME, user=DB_USER, password=DB
             write_concern=1,
         )
 
-    for chart_type, scan_types in CHARTS.items():
-        pass_count = 0
-        fail_count = 0
-        domain_total = 0
-        for domain in db.collection("domains"):
-            domain_total = domain_total + 1
-            chart_fail = False
-            for scan_type in scan_types:
-                if domain["status"][scan_type] == "fail":
-                    chart_fail = True
-
-            if chart_fail:
-                fail_count = fail_count + 1
-            else:
-                pass_count = pass_count + 1
+    chart_summaries = {chart_type: new_summary() for chart_type in CHARTS}
+    for domain in stream_query(
+        db, DOMAIN_STATUS_QUERY, bind_vars={"scan_types": SCAN_TYPES}
+    ):
+        count_chart_summaries(chart_summaries, domain["status"])
 
+    for chart_type, summary in chart_summaries.items():
         current_summary = db.collection("chartSummaries").get({"_key": chart_type})
 
         summary_exists = current_summary is not None
 
         if not summary_exists:
-            db.collection("chartSummaries").insert(
-                {
-                    "_key": chart_type,
-                    "pass": pass_count,
-                    "fail": fail_count,
-                    "total": domain_total,
-                }
-            )
+            db.collection("chartSummaries").insert({"_key": chart_type, **summary})
         else:
             db.collection("chartSummaries").update_match(
-                {"_key": chart_type},
-                {"pass": pass_count, "fail": fail_count, "total": domain_total},
+                {"_key": chart_type}, summary
             )
 
         logging.info(f"{chart_type} scan summary updated.")
@@ -358,65 +815,883 @@ def update_chart_summaries(host=DB_HOST, name=DB_NAME, user=DB_USER, password=DB
 def update_org_summaries(host=DB_HOST, name=DB_NAME, user=DB_USER, password=DB_PASS, port=DB_PORT):
     logging.info(f"Updating organization summary values...")
 
-    # Establish DB connection
-    connection_string = f"http://{host}:{port}"
-    client = ArangoClient(hosts=connection_string)
-    db = client.db(name, username=user, password=password)
-
-    for org in db.collection("organizations"):
-        web_fail = 0
-        web_pass = 0
-        mail_fail = 0
-        mail_pass = 0
-        domain_total = 0
-        claims = db.collection("claims").find({"_from": org["_id"]})
-        for claim in claims:
-            domain = db.collection("domains").get({"_id": claim["_to"]})
-            domain_total = domain_total + 1
-
-            if (
-                domain["status"]["ssl"] == "pass"
-                and domain["status"]["https"] == "pass"
-            ):
-                web_pass = web_pass + 1
-            else:
-                web_fail = web_fail + 1
-
-            if (
-                domain["status"]["dmarc"] == "pass"
-                and domain["status"]["spf"] == "pass"
-                and domain["status"]["dkim"] == "pass"
-            ):
-                mail_pass = mail_pass + 1
-            else:
-                mail_fail = mail_fail + 1
-
-        summary_data = {
-            "summaries": {
-                "web": {
-                    "pass": web_pass,
-                    "fail": web_fail,
-                    "total": domain_total,
-                },
-                "mail": {
-                    "pass": mail_pass,
-                    "fail": mail_fail,
-                    "total": domain_total,
-                }
-            }
-        }
+    db = get_db(host, port, name, user, password)
+
+    # Per-organization web/mail counts for every org in a single traversal,
+    # returning only the orgs whose summaries changed
+    cursor = stream_query(db, ORG_SUMMARY_QUERY, bind_vars={"charts": CHARTS})
 
-        org.update(summary_data)
-        db.collection("organizations").update(org)
+    written = write_org_summaries(db, cursor)
+    logging.info(f"{written} organization summaries changed.")
 
     logging.info(f"Organization summary value update completed.")
 
+    return written
+
+
+def add_summaries(summaries, other):
+    for summary_type, summary in other.items():
+        total = summaries.setdefault(summary_type, new_summary())
+        for count_type in ["pass", "fail", "total"]:
+            total[count_type] = total[count_type] + summary[count_type]
+
+
+def rollup_key(rollup_type, value):
+    # Replace characters ArangoDB doesn't allow in document keys
+    value = re.sub(r"[^A-Za-z0-9_\-:.@()+,=;$!*'%]", "_", str(value))
+    return f"{rollup_type}-{value}"
+
+
+def add_rollups(rollups, org, summaries, org_count=1):
+    # Each organization is rolled up into its zone and its sector
+    for rollup_type in ROLLUP_TYPES:
+        value = org.get(rollup_type)
+        if value is None:
+            continue
+        key = rollup_key(rollup_type, value)
+        rollup = rollups.setdefault(
+            key,
+            {
+                "_key": key,
+                "type": rollup_type,
+                "value": value,
+                "organizations": 0,
+                "summaries": {},
+            },
+        )
+        rollup["organizations"] = rollup["organizations"] + org_count
+        add_summaries(rollup["summaries"], summaries)
+
+
+def accumulate_summaries(db, partition=0, partition_count=1):
+    if partition_count > 1:
+        partition_vars = {"partition": partition, "partition_count": partition_count}
+        domain_query = PARTITION_DOMAIN_STATUS_QUERY
+        domain_vars = {"scan_types": SCAN_TYPES, **partition_vars}
+        claim_query = PARTITION_CLAIM_QUERY
+        claim_vars = partition_vars
+    else:
+        domain_query = DOMAIN_STATUS_QUERY
+        domain_vars = {"scan_types": SCAN_TYPES}
+        claim_query = CLAIM_QUERY
+        claim_vars = None
+
+    # Single pass over domains and claims loads the columnar status matrix;
+    # every summary is then evaluated over whole columns at once. The claims
+    # cursor is only opened once the domains are read, so it isn't left idle
+    # past its TTL
+    matrix = StatusMatrix(SCAN_TYPES)
+    for domain in stream_query(db, domain_query, bind_vars=domain_vars):
+        matrix.add_domain(domain["_id"], domain["status"])
+    for claim in stream_query(db, claim_query, bind_vars=claim_vars):
+        matrix.add_claim(claim["_from"], claim["_to"])
+
+    scan_summaries = matrix.scan_summaries()
+    chart_summaries = matrix.chart_summaries(CHARTS)
+    org_summaries = matrix.org_summaries(CHARTS)
+
+    # What every domain was counted as, so incremental runs can apply deltas
+    # against exactly this state; generated lazily while being written
+    snapshots = matrix.snapshots()
+
+    return scan_summaries, chart_summaries, org_summaries, snapshots
+
+
+def write_summaries(
+    db,
+    scan_summaries,
+    chart_summaries,
+    org_summaries,
+    global_summaries=True,
+    after="",
+    rollups=None,
+    checkpoint=None,
+    checkpoint_interval=CHECKPOINT_INTERVAL,
+):
+    # Global summaries are left alone when they're computed from criteria
+    if global_summaries:
+        db.collection("scanSummaries").import_bulk(
+            [{"_key": scan_type, **summary} for scan_type, summary in scan_summaries.items()],
+            on_duplicate="update",
+        )
+        logging.info(f"Scan summaries updated.")
+
+        db.collection("chartSummaries").import_bulk(
+            [{"_key": chart_type, **summary} for chart_type, summary in chart_summaries.items()],
+            on_duplicate="update",
+        )
+        logging.info(f"Chart summaries updated.")
+        record("docs_written", len(scan_summaries) + len(chart_summaries))
+
+    # Organizations without claims still get their summaries reset, and the
+    # same pass over organizations rolls them up by zone and sector
+    if rollups is None:
+        rollups = {}
+
+    def changed_org_summaries(orgs):
+        for org in orgs:
+            summaries = org_summaries.get(
+                org["_id"], {chart_type: new_summary() for chart_type in CHARTS}
+            )
+            add_rollups(rollups, org, summaries)
+            if org["summaries"] != summaries:
+                yield {"_id": org["_id"], "summaries": summaries}
+
+    # Organizations are walked in key order after the last checkpointed one,
+    # and a checkpoint is only taken once a chunk's changes are written
+    orgs = stream_query(db, ORG_QUERY, bind_vars={"charts": CHARTS, "after": after})
+    if checkpoint is None:
+        written = write_org_summaries(db, changed_org_summaries(orgs))
+    else:
+        written = 0
+        while True:
+            chunk = list(islice(orgs, checkpoint_interval))
+            if not chunk:
+                break
+            written = written + write_org_summaries(db, changed_org_summaries(chunk))
+            checkpoint(chunk[-1]["_key"], rollups)
+    logging.info(f"Organization summaries updated, {written} changed.")
+
+    create_collection_if_missing(db, "summaryRollups")
+    db.collection("summaryRollups").import_bulk(
+        list(rollups.values()), on_duplicate="replace"
+    )
+    db.aql.execute(REMOVE_STALE_ROLLUPS_QUERY, bind_vars={"keys": list(rollups)})
+    record("docs_written", len(rollups))
+    logging.info(f"Zone and sector rollups updated, {len(rollups)} written.")
+
+
+def write_status_snapshots(db, snapshots, summarized_at, batch_size=SUMMARY_BATCH_SIZE):
+    batch = []
+    for snapshot in counted(snapshots, "docs_written"):
+        batch.append({**snapshot, "summarizedAt": summarized_at})
+        if len(batch) >= batch_size:
+            db.collection("summaryStatuses").import_bulk(batch, on_duplicate="replace")
+            batch = []
+    if batch:
+        db.collection("summaryStatuses").import_bulk(batch, on_duplicate="replace")
+
+
+def update_summaries(
+    host=DB_HOST,
+    name=DB_NAME,
+    user=DB_USER,
+    password=DB_PASS,
+    port=DB_PORT,
+    global_summaries=True,
+    run_id=RUN_ID,
+    checkpoint_interval=CHECKPOINT_INTERVAL,
+    checkpoint_max_age=FULL_RECOMPUTE_INTERVAL,
+    write_snapshots=False,
+):
+    logging.info(f"Updating summaries...")
+
+    db = get_db(host, port, name, user, password)
+
+    for collection in ["scanSummaries", "chartSummaries"]:
+        create_collection_if_missing(db, collection)
+    # Snapshots are only read by incremental runs, so other runs skip writing
+    # one document per domain
+    if write_snapshots:
+        create_collection_if_missing(db, "summaryStatuses")
+
+    # A retry of the same run picks up the summaries it already computed and
+    # carries on after the last organization it wrote, unless they're too old
+    checkpoint = get_core_state(db, "summaryCheckpoint") if run_id else None
+    if (
+        checkpoint is not None
+        and checkpoint["run"] == run_id
+        and datetime.datetime.utcnow()
+        - datetime.datetime.fromisoformat(checkpoint["summarizedAt"])
+        < datetime.timedelta(hours=checkpoint_max_age)
+    ):
+        logging.info(
+            f"Resuming summary run {run_id} after organization '{checkpoint['lastOrgKey']}'."
+        )
+    else:
+        summarized_at = str(datetime.datetime.utcnow())
+        scan_summaries, chart_summaries, org_summaries, snapshots = accumulate_summaries(
+            db
+        )
+        if write_snapshots:
+            write_status_snapshots(db, snapshots, summarized_at)
+        checkpoint = {
+            "run": run_id,
+            "summarizedAt": summarized_at,
+            "scanSummaries": scan_summaries,
+            "chartSummaries": chart_summaries,
+            "orgSummaries": org_summaries,
+            "lastOrgKey": "",
+            "rollups": {},
+        }
+        if run_id:
+            set_core_state(db, "summaryCheckpoint", checkpoint)
+
+    # Only the progress is rewritten, the summaries are stored once
+    def save_checkpoint(last_org_key, rollups):
+        db.collection("coreState").update(
+            {"_key": "summaryCheckpoint", "lastOrgKey": last_org_key, "rollups": rollups},
+            merge=False,
+        )
+
+    write_summaries(
+        db,
+        checkpoint["scanSummaries"],
+        checkpoint["chartSummaries"],
+        checkpoint["orgSummaries"],
+        global_summaries,
+        after=checkpoint["lastOrgKey"],
+        rollups=checkpoint["rollups"],
+        checkpoint=save_checkpoint if run_id else None,
+        checkpoint_interval=checkpoint_interval,
+    )
+
+    summarized_at = checkpoint["summarizedAt"]
+    if write_snapshots:
+        db.aql.execute(
+            REMOVE_STALE_STATUSES_QUERY, bind_vars={"summarized_at": summarized_at}
+        )
+        set_core_state(db, "summaries", {"lastFullRecompute": summarized_at})
+    else:
+        # The summaries no longer match the snapshots, so the next incremental
+        # run has to start with a full recompute
+        clear_core_state(db, "summaries")
+    if run_id:
+        db.collection("coreState").delete("summaryCheckpoint", ignore_missing=True)
+
+    logging.info(f"Summary update completed.")
+
+
+def update_summary_partition(
+    host=DB_HOST,
+    name=DB_NAME,
+    user=DB_USER,
+    password=DB_PASS,
+    port=DB_PORT,
+    partition=PARTITION_INDEX,
+    partition_count=PARTITION_COUNT,
+    run_id=PARTITION_RUN_ID,
+    global_summaries=True,
+    write_snapshots=False,
+):
+    if not run_id:
+        raise ValueError("A run ID shared by every partition is required.")
+
+    logging.info(f"Updating summary partition {partition + 1} of {partition_count}...")
+
+    db = get_db(host, port, name, user, password)
+
+    for collection in ["scanSummaries", "chartSummaries", "summaryPartials"]:
+        create_collection_if_missing(db, collection)
+    if write_snapshots:
+        create_collection_if_missing(db, "summaryStatuses")
+
+    scan_summaries, chart_summaries, org_summaries, snapshots = accumulate_summaries(
+        db, partition, partition_count
+    )
+
+    # Snapshots are tagged with the run so the merge can drop stale ones
+    if write_snapshots:
+        write_status_snapshots(db, snapshots, run_id)
+    db.collection("summaryPartials").insert(
+        {
+            "_key": f"{run_id}-{partition}",
+            "run": run_id,
+            "partition": partition,
+            "scanSummaries": scan_summaries,
+            "chartSummaries": chart_summaries,
+            "orgSummaries": org_summaries,
+        },
+        overwrite=True,
+    )
+    logging.info(f"Summary partition {partition + 1} of {partition_count} staged.")
+
+    # Whichever worker stages the last partition performs the merge
+    return merge_summary_partitions(
+        host,
+        name,
+        user,
+        password,
+        port,
+        partition_count,
+        run_id,
+        global_summaries,
+        write_snapshots,
+    )
+
+
+def merge_summary_partitions(
+    host=DB_HOST,
+    name=DB_NAME,
+    user=DB_USER,
+    password=DB_PASS,
+    port=DB_PORT,
+    partition_count=PARTITION_COUNT,
+    run_id=PARTITION_RUN_ID,
+    global_summaries=True,
+    write_snapshots=False,
+):
+    db = get_db(host, port, name, user, password)
+
+    partials = list(
+        db.aql.execute(SUMMARY_PARTIALS_QUERY, bind_vars={"run": run_id})
+    )
+    if len(partials) < partition_count:
+        logging.info(
+            f"{len(partials)} of {partition_count} summary partitions staged, merge deferred."
+        )
+        return False
+
+    logging.info(f"Merging {partition_count} summary partitions...")
+
+    scan_summaries = {}
+    chart_summaries = {}
+    org_summaries = {}
+    for partial in partials:
+        add_summaries(scan_summaries, partial["scanSummaries"])
+        add_summaries(chart_summaries, partial["chartSummaries"])
+        for org_id, summaries in partial["orgSummaries"].items():
+            add_summaries(org_summaries.setdefault(org_id, {}), summaries)
+
+    write_summaries(
+        db, scan_summaries, chart_summaries, org_summaries, global_summaries
+    )
+
+    if write_snapshots:
+        db.aql.execute(
+            REMOVE_STALE_STATUSES_QUERY, bind_vars={"summarized_at": run_id}
+        )
+        set_core_state(
+            db, "summaries", {"lastFullRecompute": str(datetime.datetime.utcnow())}
+        )
+    else:
+        clear_core_state(db, "summaries")
+    db.aql.execute(REMOVE_SUMMARY_PARTIALS_QUERY, bind_vars={"run": run_id})
+
+    logging.info(f"Summary partitions merged.")
+
+    return True
+
+
+def update_summaries_incremental(
+    host=DB_HOST,
+    name=DB_NAME,
+    user=DB_USER,
+    password=DB_PASS,
+    port=DB_PORT,
+    full_recompute_interval=FULL_RECOMPUTE_INTERVAL,
+    global_summaries=True,
+):
+    logging.info(f"Updating summaries incrementally...")
+
+    db = get_db(host, port, name, user, password)
+
+    # Without a snapshot to diff against, or once the snapshot is older than
+    # the configured interval, fall back to a full recompute as a
+    # consistency check
+    state = get_core_state(db, "summaries")
+    if state is None or not db.has_collection("summaryStatuses"):
+        logging.info(f"No summary snapshot found, performing full recompute.")
+        return update_summaries(
+            host, name, user, password, port, global_summaries, write_snapshots=True
+        )
+
+    last_full_recompute = datetime.datetime.fromisoformat(state["lastFullRecompute"])
+    if datetime.datetime.utcnow() - last_full_recompute >= datetime.timedelta(
+        hours=full_recompute_interval
+    ):
+        logging.info(f"Full summary recompute due, performing full recompute.")
+        return update_summaries(
+            host, name, user, password, port, global_summaries, write_snapshots=True
+        )
+
+    changes = list(
+        stream_query(db, STATUS_CHANGE_QUERY, bind_vars={"scan_types": SCAN_TYPES})
+    )
+    changes.extend(stream_query(db, REMOVED_STATUS_QUERY))
+    logging.info(f"{len(changes)} domains changed since the last summary update.")
+
+    if not changes:
+        logging.info(f"Incremental summary update completed.")
+        return
+
+    # Remove each changed domain's previous contribution and add its current one
+    scan_deltas = {scan_type: new_summary() for scan_type in SCAN_TYPES}
+    chart_deltas = {chart_type: new_summary() for chart_type in CHARTS}
+    org_deltas = {}
+    for change in changes:
+        for side, weight in [("old", -1), ("new", 1)]:
+            if change[side] is None:
+                continue
+            status = change[side]["status"]
+            count_scan_summaries(scan_deltas, status, weight)
+            count_chart_summaries(chart_deltas, status, weight)
+            for org_id in change[side]["orgs"]:
+                org_delta = org_deltas.setdefault(
+                    org_id, {chart_type: new_summary() for chart_type in CHARTS}
+                )
+                count_org_summaries(org_delta, status, weight)
+
+    summarized_at = str(datetime.datetime.utcnow())
+    snapshots = [
+        {"_key": change["_key"], **change["new"], "summarizedAt": summarized_at}
+        for change in changes
+        if change["new"] is not None
+    ]
+    removed = [
+        {"_key": change["_key"]} for change in changes if change["new"] is None
+    ]
+
+    # Organization deltas roll up into their zone and sector
+    create_collection_if_missing(db, "summaryRollups")
+    rollup_deltas = {}
+    if org_deltas:
+        for org in stream_query(
+            db, ORG_ROLLUP_QUERY, bind_vars={"org_ids": list(org_deltas)}
+        ):
+            add_rollups(rollup_deltas, org, org_deltas[org["_id"]], org_count=0)
+
+    # Deltas and snapshots are committed together so a crash can't apply a
+    # change twice
+    txn_db = db.begin_transaction(
+        write=[
+            "scanSummaries",
+            "chartSummaries",
+            "organizations",
+            "summaryStatuses",
+            "summaryRollups",
+        ]
+    )
+    try:
+        if global_summaries:
+            txn_db.aql.execute(
+                APPLY_SUMMARY_DELTAS_QUERY,
+                bind_vars={
+                    "@collection": "scanSummaries",
+                    "deltas": [{"_key": k, **v} for k, v in scan_deltas.items()],
+                },
+            )
+            txn_db.aql.execute(
+                APPLY_SUMMARY_DELTAS_QUERY,
+                bind_vars={
+                    "@collection": "chartSummaries",
+                    "deltas": [{"_key": k, **v} for k, v in chart_deltas.items()],
+                },
+            )
+        txn_db.aql.execute(
+            APPLY_ORG_SUMMARY_DELTAS_QUERY,
+            bind_vars={
+                "deltas": [
+                    {"_id": org_id, "summaries": summaries}
+                    for org_id, summaries in org_deltas.items()
+                ]
+            },
+        )
+        if rollup_deltas:
+            txn_db.aql.execute(
+                APPLY_ROLLUP_DELTAS_QUERY,
+                bind_vars={"deltas": list(rollup_deltas.values())},
+            )
+        txn_db.collection("summaryStatuses").import_bulk(
+            snapshots, on_duplicate="replace"
+        )
+        if removed:
+            txn_db.collection("summaryStatuses").delete_many(removed)
+        txn_db.commit_transaction()
+        record(
+            "docs_written",
+            len(org_deltas) + len(rollup_deltas) + len(snapshots) + len(removed),
+        )
+    except Exception:
+        txn_db.abort_transaction()
+        raise
+
+    logging.info(f"Incremental summary update completed.")
+
+
+def run_summaries(
+    mode=SUMMARY_MODE, partition_count=PARTITION_COUNT, source=SUMMARY_SOURCE
+):
+    global_summaries = source != "criteria"
+    write_snapshots = mode == "incremental"
+    if partition_count > 1:
+        merged = update_summary_partition(
+            global_summaries=global_summaries, write_snapshots=write_snapshots
+        )
+        # Only the worker that merged the partitions has new summaries to
+        # record, the others only staged theirs
+        if merged:
+            record_summary_history()
+        return merged
+    if mode == "incremental":
+        return update_summaries_incremental(global_summaries=global_summaries)
+    if mode == "separate":
+        # Each summary computed by its own queries, organizations from one
+        # claims traversal instead of the fused domain pass
+        if global_summaries:
+            update_scan_summaries()
+            update_chart_summaries()
+        return update_org_summaries()
+    return update_summaries(global_summaries=global_summaries)
+
+
+def load_summary_criteria(db, collection, suffix, default=None):
+    # Criteria keys are the summary type followed by a fixed suffix, e.g.
+    # webSummaryCriteria or httpsScanSummaryCriteria
+    criteria = {}
+    if db.has_collection(collection):
+        for doc in stream_query(db, CRITERIA_QUERY, bind_vars={"@collection": collection}):
+            if not doc["_key"].endswith(suffix):
+                logging.warning(
+                    f"Skipping {collection} document {doc['_key']}, expected a key ending in {suffix}."
+                )
+                continue
+            criteria[doc["_key"][: -len(suffix)]] = doc
+    return SummaryCriteria(criteria, default=default)
+
+
+def update_criteria_summaries(host=DB_HOST, name=DB_NAME, user=DB_USER, password=DB_PASS, port=DB_PORT):
+    logging.info(f"Updating summaries from criteria...")
+
+    db = get_db(host, port, name, user, password)
+
+    for collection in ["scanSummaries", "chartSummaries"]:
+        create_collection_if_missing(db, collection)
+
+    # Scan summaries leave domains matching neither list out of pass/fail,
+    # while charts count anything that doesn't pass as failing
+    scan_criteria = load_summary_criteria(
+        db, "scanSummaryCriteria", "ScanSummaryCriteria"
+    )
+    chart_criteria = load_summary_criteria(
+        db, "chartSummaryCriteria", "SummaryCriteria", default="fail"
+    )
+
+    scan_summaries = {scan_type: new_summary() for scan_type in scan_criteria.masks}
+    chart_summaries = {chart_type: new_summary() for chart_type in chart_criteria.masks}
+
+    for tags in stream_query(
+        db,
+        DOMAIN_TAGS_QUERY,
+        bind_vars={"tags": list(set(scan_criteria.tags + chart_criteria.tags))},
+    ):
+        for criteria, summaries in [
+            (scan_criteria, scan_summaries),
+            (chart_criteria, chart_summaries),
+        ]:
+            for summary_type, result in criteria.evaluate(
+                criteria.tag_mask(tags)
+            ).items():
+                summary = summaries[summary_type]
+                summary["total"] = summary["total"] + 1
+                if result is not None:
+                    summary[result] = summary[result] + 1
+
+    db.collection("scanSummaries").import_bulk(
+        [{"_key": scan_type, **summary} for scan_type, summary in scan_summaries.items()],
+        on_duplicate="update",
+    )
+    db.collection("chartSummaries").import_bulk(
+        [{"_key": chart_type, **summary} for chart_type, summary in chart_summaries.items()],
+        on_duplicate="update",
+    )
+    record("docs_written", len(scan_summaries) + len(chart_summaries))
+
+    logging.info(f"Criteria summary update completed.")
+
+
+def history_buckets(recorded_at):
+    # The start of the run, day, week and month a summary was recorded in;
+    # each run overwrites its day, week and month bucket so they hold the
+    # last counts of their period
+    day = recorded_at.date()
+    return {
+        "run": recorded_at.isoformat(timespec="seconds"),
+        "day": day.isoformat(),
+        "week": (day - datetime.timedelta(days=day.weekday())).isoformat(),
+        "month": day.replace(day=1).isoformat(),
+    }
+
+
+def history_key(subject, chart, resolution, bucket_time):
+    return hashlib.sha1(
+        f"{subject}|{chart}|{resolution}|{bucket_time}".encode()
+    ).hexdigest()
+
+
+def record_summary_history(
+    host=DB_HOST,
+    name=DB_NAME,
+    user=DB_USER,
+    password=DB_PASS,
+    port=DB_PORT,
+    retention=HISTORY_RETENTION,
+    recorded_at=None,
+    batch_size=SUMMARY_BATCH_SIZE,
+):
+    logging.info(f"Recording summary history...")
+
+    db = get_db(host, port, name, user, password)
+
+    if recorded_at is None:
+        recorded_at = datetime.datetime.utcnow()
+    buckets = history_buckets(recorded_at)
+
+    if not db.has_collection("summaryHistory"):
+        create_collection_if_missing(db, "summaryHistory")
+        # Range reads for one subject's chart, and expiry by resolution
+        db.collection("summaryHistory").add_persistent_index(
+            fields=["subject", "chart", "resolution", "time"]
+        )
+        db.collection("summaryHistory").add_persistent_index(
+            fields=["resolution", "time"]
+        )
+
+    sources = [
+        (SUMMARY_HISTORY_QUERY, "scanSummaries", {"subject": "scan"}),
+        (SUMMARY_HISTORY_QUERY, "chartSummaries", {"subject": "chart"}),
+        (NESTED_SUMMARY_HISTORY_QUERY, "organizations", {}),
+        (NESTED_SUMMARY_HISTORY_QUERY, "summaryRollups", {}),
+    ]
+
+    # Only counts are kept, one entry per subject, chart and resolution
+    def history_entries():
+        for query, collection, bind_vars in sources:
+            if not db.has_collection(collection):
+                continue
+            for summary in stream_query(
+                db, query, bind_vars={"@collection": collection, **bind_vars}
+            ):
+                for resolution, bucket_time in buckets.items():
+                    yield {
+                        "_key": history_key(
+                            summary["subject"], summary["chart"], resolution, bucket_time
+                        ),
+                        "resolution": resolution,
+                        "time": bucket_time,
+                        **summary,
+                    }
+
+    written = 0
+    batch = []
+    for entry in history_entries():
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            db.collection("summaryHistory").import_bulk(batch, on_duplicate="replace")
+            written = written + len(batch)
+            batch = []
+    if batch:
+        db.collection("summaryHistory").import_bulk(batch, on_duplicate="replace")
+        written = written + len(batch)
+    record("docs_written", written)
+
+    # Older entries are downsampled by letting finer resolutions expire
+    for resolution, days in retention.items():
+        if days <= 0:
+            continue
+        before = history_buckets(recorded_at - datetime.timedelta(days=days))[resolution]
+        db.aql.execute(
+            REMOVE_EXPIRED_HISTORY_QUERY,
+            bind_vars={"resolution": resolution, "before": before},
+        )
+
+    logging.info(f"Summary history recorded, {written} entries written.")
+    return written
+
+
+def summary_watermark(db, source=SUMMARY_SOURCE):
+    # A collection's revision changes on every write to it, so unchanged
+    # revisions mean no status, scan or claim was written since. Organizations
+    # are counted instead since the summaries themselves are written to them
+    collections = ["domains", "claims"]
+    if source == "criteria":
+        collections = (
+            collections
+            + SCAN_COLLECTIONS
+            + ["scanSummaryCriteria", "chartSummaryCriteria"]
+        )
+    revisions = {
+        collection: db.collection(collection).revision()
+        for collection in collections
+        if db.has_collection(collection)
+    }
+    return {
+        "revisions": revisions,
+        "organizations": db.collection("organizations").count(),
+    }
+
+
+def check_summary_watermark(
+    host=DB_HOST,
+    name=DB_NAME,
+    user=DB_USER,
+    password=DB_PASS,
+    port=DB_PORT,
+    source=SUMMARY_SOURCE,
+):
+    db = get_db(host, port, name, user, password)
+    watermark = summary_watermark(db, source)
+    state = get_core_state(db, "watermark")
+    unchanged = state is not None and state.get("watermark") == watermark
+    return unchanged, watermark
+
+
+def save_summary_watermark(
+    watermark, host=DB_HOST, name=DB_NAME, user=DB_USER, password=DB_PASS, port=DB_PORT
+):
+    db = get_db(host, port, name, user, password)
+    set_core_state(
+        db,
+        "watermark",
+        {"watermark": watermark, "recordedAt": str(datetime.datetime.utcnow())},
+    )
+
+
+def run_stages(stages, workers=CORE_WORKERS):
+    # stages maps a stage name to (function, [names of stages it depends on])
+    for stage_name, (_, dependencies) in stages.items():
+        for dependency in dependencies:
+            if dependency not in stages:
+                raise ValueError(
+                    f"Stage {stage_name} depends on unknown stage {dependency}."
+                )
+
+    results = {}
+    running = {}
+    metrics = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(results) < len(stages):
+            # Skips can cascade through stages listed in any order, so stages
+            # are scheduled until a pass changes nothing
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for stage_name, (stage, dependencies) in stages.items():
+                    if stage_name in results or stage_name in running:
+                        continue
+                    if any(
+                        results.get(dependency, {}).get("status") in ["failed", "skipped"]
+                        for dependency in dependencies
+                    ):
+                        results[stage_name] = {"status": "skipped", "duration": 0}
+                        logging.warning(f"Stage {stage_name} skipped, a dependency did not complete.")
+                        scheduled = True
+                    elif all(dependency in results for dependency in dependencies):
+                        logging.info(f"Stage {stage_name} started.")
+                        metrics[stage_name] = StageMetrics(stage_name)
+                        running[stage_name] = executor.submit(metrics[stage_name].run, stage)
+                        scheduled = True
+
+            if len(results) == len(stages):
+                break
+            if not running:
+                raise ValueError("Stage dependencies contain a cycle.")
+
+            done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for stage_name, future in list(running.items()):
+                if future not in done:
+                    continue
+                del running[stage_name]
+                duration = metrics[stage_name].wall_time
+                try:
+                    results[stage_name] = {
+                        "status": "completed",
+                        "duration": duration,
+                        "metrics": metrics[stage_name],
+                        "result": future.result(),
+                    }
+                    logging.info(f"Stage {stage_name} completed in {duration:.2f}s.")
+                except Exception as e:
+                    results[stage_name] = {
+                        "status": "failed",
+                        "duration": duration,
+                        "metrics": metrics[stage_name],
+                        "error": f"{type(e).__name__}: {str(e)}",
+                    }
+                    logging.error(
+                        f"Stage {stage_name} failed after {duration:.2f}s: {str(e)}\n\nFull traceback: {traceback.format_exc()}"
+                    )
+
+    return results
+
+
+# Guidance sync and the summaries share no data, so they run side by side
+CORE_STAGES = {
+    "guidance": (sync_guidance, []),
+    "summaries": (run_summaries, []),
+}
+
+# Criteria-driven summaries need the criteria guidance sync stores
+if SUMMARY_SOURCE == "criteria":
+    CORE_STAGES["criteria_summaries"] = (update_criteria_summaries, ["guidance"])
+
+# History records the summaries once every summary stage has written them
+CORE_STAGES["history"] = (
+    record_summary_history,
+    [stage for stage in CORE_STAGES if stage != "guidance"],
+)
+
+# Stages skipped when the summary watermark hasn't moved. History still runs
+# so quiet periods don't leave gaps in its buckets
+SUMMARY_STAGES = [
+    stage for stage in CORE_STAGES if stage not in ["guidance", "history"]
+]
+
 
 if __name__ == "__main__":
     logging.info(emoji.emojize("Core service started :rocket:"))
-    guidance_data = retrieve_guidance()
-    update_guidance(guidance_data)
-    update_scan_summaries()
-    update_chart_summaries()
-    update_org_summaries()
+    # Tracing allocations slows every stage down, so it's opt-in
+    if TRACEMALLOC:
+        tracemalloc.start()
+    # Only the first partition syncs guidance when core runs partitioned
+    if PARTITION_INDEX == 0:
+        stages = CORE_STAGES
+    else:
+        stages = {"summaries": CORE_STAGES["summaries"]}
+    # Partitioned runs record history as part of the merge
+    if PARTITION_COUNT > 1:
+        stages = {stage: stages[stage] for stage in stages if stage != "history"}
+
+    # The watermark is taken before the summaries are computed, so anything
+    # written while they run is picked up by the next run
+    watermark = None
+    if SKIP_UNCHANGED and PARTITION_COUNT == 1:
+        unchanged, watermark = check_summary_watermark()
+        if unchanged:
+            logging.info(f"Nothing changed since the last summary run, skipping summaries.")
+            # Stages left waiting on a skipped stage run without it
+            stages = {
+                stage: (
+                    function,
+                    [
+                        dependency
+                        for dependency in dependencies
+                        if dependency not in SUMMARY_STAGES
+                    ],
+                )
+                for stage, (function, dependencies) in stages.items()
+                if stage not in SUMMARY_STAGES
+            }
+            watermark = None
+
+    stage_results = run_stages(stages)
+    for stage_name, stage_result in stage_results.items():
+        logging.info(
+            f"Stage {stage_name}: {stage_result['status']} ({stage_result['duration']:.2f}s)"
+        )
+    stage_metrics = [
+        stage_result["metrics"]
+        for stage_result in stage_results.values()
+        if "metrics" in stage_result
+    ]
+    logging.info(json.dumps({"stages": [metrics.as_dict() for metrics in stage_metrics]}))
+    if METRICS_TEXTFILE:
+        write_prometheus_textfile(stage_metrics, METRICS_TEXTFILE)
+    if watermark is not None and all(
+        stage_results[stage]["status"] == "completed" for stage in SUMMARY_STAGES
+    ):
+        save_summary_watermark(watermark)
     logging.info(f"Core service shutting down...")
+    if any(stage_result["status"] != "completed" for stage_result in stage_results.values()):
+        sys.exit(1)
@@ -0,0 +1,145 @@
+"""Shared ArangoDB connection handling for the Python services.
+
+One pooled client is created per process and host, and every caller reuses it
+so TCP/TLS connections are kept alive between stages instead of being set up
+again for each one. Pool size, timeout and retries are tunable through the
+environment variables below.
+"""
+import os
+import threading
+import requests
+from arango import ArangoClient
+from arango.http import HTTPClient
+from arango.response import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "60"))
+DB_RETRIES = int(os.getenv("DB_RETRIES", "3"))
+DB_BACKOFF = float(os.getenv("DB_BACKOFF", "0.5"))
+
+_lock = threading.Lock()
+_clients = {}
+_databases = {}
+_observers = []
+
+
+def add_request_observer(observer):
+    """Registers a function called after every database request.
+
+    :param observer: Called with the request's method, URL, bytes sent and bytes received.
+    """
+    _observers.append(observer)
+
+
+class PooledHTTPClient(HTTPClient):
+    """HTTP client for python-arango backed by a keep-alive connection pool.
+
+    :param int pool_size: Maximum number of connections kept open per host.
+    :param float timeout: Seconds to wait for a response before giving up.
+    :param int retries: Number of times a failed request is retried.
+    :param float backoff: Backoff factor applied between retries.
+    """
+
+    def __init__(
+        self,
+        pool_size=DB_POOL_SIZE,
+        timeout=DB_TIMEOUT,
+        retries=DB_RETRIES,
+        backoff=DB_BACKOFF,
+    ):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    def create_session(self, host):
+        """Creates a pooled session for the given host.
+
+        :param str host: ArangoDB host URL.
+        :return: A requests session with a sized, retrying adapter mounted.
+        :rtype: requests.Session
+        """
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=Retry(total=self.retries, backoff_factor=self.backoff),
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def send_request(
+        self, session, method, url, headers=None, params=None, data=None, auth=None
+    ):
+        """Sends an HTTP request through the pooled session.
+
+        :return: The response in the form python-arango expects.
+        :rtype: arango.response.Response
+        """
+        response = session.request(
+            method=method,
+            url=url,
+            params=params,
+            data=data,
+            headers=headers,
+            auth=auth,
+            timeout=self.timeout,
+        )
+        for observer in _observers:
+            observer(method, url, len(data) if data else 0, len(response.content))
+        return Response(
+            method=method,
+            url=response.url,
+            headers=response.headers,
+            status_code=response.status_code,
+            status_text=response.reason,
+            raw_body=response.text,
+        )
+
+
+def get_client(host, port, **pool_options):
+    """Returns the process-wide pooled client for an ArangoDB host, creating it on first use.
+
+    :param str host: DB host name.
+    :param port: DB TCP port.
+    :param pool_options: Overrides for PooledHTTPClient's settings, only used when the client is created.
+    :return: The shared client for this host.
+    :rtype: ArangoClient
+    """
+    connection_string = f"http://{host}:{port}"
+    with _lock:
+        client = _clients.get(connection_string)
+        if client is None:
+            client = ArangoClient(
+                hosts=connection_string,
+                http_client=PooledHTTPClient(**pool_options),
+            )
+            _clients[connection_string] = client
+    return client
+
+
+def get_db(host, port, name, user, password, **pool_options):
+    """Returns a database handle that shares the host's pooled client.
+
+    :param str host: DB host name.
+    :param port: DB TCP port.
+    :param str name: Name of the DB to connect to.
+    :param str user: Username to connect to DB with.
+    :param str password: Password to connect to DB with.
+    :param pool_options: Overrides for PooledHTTPClient's settings, only used when the client is created.
+    :return: The database handle.
+    :rtype: arango.database.StandardDatabase
+    """
+    key = (host, str(port), name, user, password)
+    with _lock:
+        db = _databases.get(key)
+    if db is None:
+        db = get_client(host, port, **pool_options).db(
+            name, username=user, password=password
+        )
+        with _lock:
+            _databases[key] = db
+    return db
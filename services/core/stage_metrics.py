@@ -0,0 +1,143 @@
+"""Per-stage instrumentation for core runs.
+
+Each stage gets a StageMetrics that is made current on the thread running the
+stage, so database requests and document counts recorded anywhere below it
+are attributed to that stage without being passed around. Memory figures are
+process-wide since stages share the process and may run side by side.
+"""
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+COUNTERS = ["db_requests", "bytes_sent", "bytes_received", "docs_read", "docs_written"]
+
+_local = threading.local()
+
+
+class StageMetrics:
+    """Counters and timings collected while a stage runs.
+
+    :param str stage: The stage's name.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.wall_time = 0.0
+        self.peak_rss_bytes = None
+        self.traced_peak_bytes = None
+
+    def add(self, counter, value=1):
+        self.counters[counter] = self.counters[counter] + value
+
+    def run(self, function):
+        """Calls a stage function with these metrics current on this thread.
+
+        :param function: The stage function, called without arguments.
+        :return: The stage function's return value.
+        """
+        _local.metrics = self
+        started = time.monotonic()
+        try:
+            return function()
+        finally:
+            self.wall_time = time.monotonic() - started
+            self.peak_rss_bytes = peak_rss_bytes()
+            if tracemalloc.is_tracing():
+                self.traced_peak_bytes = tracemalloc.get_traced_memory()[1]
+            _local.metrics = None
+
+    def as_dict(self):
+        return {
+            "stage": self.stage,
+            "wall_time": round(self.wall_time, 3),
+            **self.counters,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "traced_peak_bytes": self.traced_peak_bytes,
+        }
+
+
+def current_metrics():
+    return getattr(_local, "metrics", None)
+
+
+def record(counter, value=1):
+    """Adds to a counter of the stage running on this thread, if any.
+
+    :param str counter: One of COUNTERS.
+    :param int value: Amount to add.
+    """
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add(counter, value)
+
+
+def record_request(method, url, bytes_sent, bytes_received):
+    """Request observer for database.add_request_observer."""
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add("db_requests")
+        metrics.add("bytes_sent", bytes_sent)
+        metrics.add("bytes_received", bytes_received)
+
+
+def counted(documents, counter="docs_read"):
+    """Passes documents through, counting them once iteration ends.
+
+    :param documents: Any iterable of documents, e.g. a cursor.
+    :param str counter: The counter to add the number of documents to.
+    :return: A generator over the same documents.
+    :rtype: generator
+    """
+    metrics = current_metrics()
+    count = 0
+    try:
+        for document in documents:
+            count = count + 1
+            yield document
+    finally:
+        if metrics is not None:
+            metrics.add(counter, count)
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def prometheus_text(stage_metrics, prefix="core_stage"):
+    """Renders stage metrics in the Prometheus text exposition format.
+
+    :param list stage_metrics: StageMetrics of every stage that ran.
+    :param str prefix: Prefix of every metric name.
+    :rtype: str
+    """
+    lines = []
+    gauges = [("wall_time_seconds", "wall_time")] + [(name, name) for name in COUNTERS]
+    gauges = gauges + [
+        ("peak_rss_bytes", "peak_rss_bytes"),
+        ("traced_peak_bytes", "traced_peak_bytes"),
+    ]
+    rows = [metrics.as_dict() for metrics in stage_metrics]
+    for metric_name, field in gauges:
+        lines.append(f"# TYPE {prefix}_{metric_name} gauge")
+        for row in rows:
+            if row[field] is not None:
+                lines.append(f'{prefix}_{metric_name}{{stage="{row["stage"]}"}} {row[field]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_textfile(stage_metrics, path):
+    """Writes stage metrics for the node exporter's textfile collector.
+
+    The file is replaced in one rename so the collector never reads a partial file.
+
+    :param list stage_metrics: StageMetrics of every stage that ran.
+    :param str path: Path of the .prom file to write.
+    """
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as textfile:
+        textfile.write(prometheus_text(stage_metrics))
+    os.replace(temporary_path, path)
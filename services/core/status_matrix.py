@@ -0,0 +1,180 @@
+"""Columnar in-memory store of domain scan statuses used to compute summaries.
+
+Each scan type's statuses are kept as one int8 column with a row per domain,
+and claims as two parallel index arrays, so scan, chart and organization
+summaries are computed with vectorized masks and bincount group-bys instead
+of per-domain Python loops.
+"""
+from array import array
+import numpy as np
+
+# Codes reserved in every column; any other status value gets the next free code
+MISSING = 0
+PASS = 1
+FAIL = 2
+
+
+class StatusMatrix:
+    """Domain statuses for a set of scan types, plus the claims on those domains.
+
+    :param list scan_types: Scan types to keep a column for.
+    """
+
+    def __init__(self, scan_types):
+        self.scan_types = list(scan_types)
+        self.domain_ids = []
+        self.domain_index = {}
+        self.columns = {scan_type: array("b") for scan_type in self.scan_types}
+        self.codes = {scan_type: {"pass": PASS, "fail": FAIL} for scan_type in self.scan_types}
+        self.values = {
+            scan_type: [MISSING, "pass", "fail"] for scan_type in self.scan_types
+        }
+        self.org_ids = []
+        self.org_index = {}
+        self.claim_domains = array("q")
+        self.claim_orgs = array("q")
+
+    def __len__(self):
+        return len(self.domain_ids)
+
+    def _code(self, scan_type, value):
+        codes = self.codes[scan_type]
+        code = codes.get(value)
+        if code is None:
+            code = len(self.values[scan_type])
+            if code > 127:
+                raise ValueError(f"Too many distinct {scan_type} status values.")
+            codes[value] = code
+            self.values[scan_type].append(value)
+        return code
+
+    def add_domain(self, domain_id, status):
+        """Adds a row for a domain.
+
+        :param str domain_id: The domain's _id.
+        :param dict status: The domain's status, keyed by scan type.
+        """
+        self.domain_index[domain_id] = len(self.domain_ids)
+        self.domain_ids.append(domain_id)
+        for scan_type in self.scan_types:
+            if scan_type in status:
+                self.columns[scan_type].append(self._code(scan_type, status[scan_type]))
+            else:
+                self.columns[scan_type].append(MISSING)
+
+    def add_claim(self, org_id, domain_id):
+        """Records an organization's claim on a domain already in the matrix.
+
+        :param str org_id: The claiming organization's _id.
+        :param str domain_id: The claimed domain's _id.
+        :return: False if the domain isn't in the matrix and the claim was ignored.
+        :rtype: bool
+        """
+        row = self.domain_index.get(domain_id)
+        if row is None:
+            return False
+        org = self.org_index.get(org_id)
+        if org is None:
+            org = len(self.org_ids)
+            self.org_index[org_id] = org
+            self.org_ids.append(org_id)
+        self.claim_domains.append(row)
+        self.claim_orgs.append(org)
+        return True
+
+    def column(self, scan_type):
+        return np.frombuffer(self.columns[scan_type], dtype=np.int8)
+
+    def scan_summaries(self):
+        """Counts every domain once per scan type; statuses other than pass or
+        fail only count towards the total.
+
+        :return: pass/fail/total for each scan type.
+        :rtype: dict
+        """
+        summaries = {}
+        for scan_type in self.scan_types:
+            column = self.column(scan_type)
+            summaries[scan_type] = {
+                "pass": int(np.count_nonzero(column == PASS)),
+                "fail": int(np.count_nonzero(column == FAIL)),
+                "total": len(self),
+            }
+        return summaries
+
+    def chart_summaries(self, charts):
+        """Counts a domain as failing a chart if any of the chart's scan types failed.
+
+        :param dict charts: Scan types making up each chart.
+        :return: pass/fail/total for each chart.
+        :rtype: dict
+        """
+        summaries = {}
+        for chart_type, scan_types in charts.items():
+            failed = np.zeros(len(self), dtype=bool)
+            for scan_type in scan_types:
+                failed |= self.column(scan_type) == FAIL
+            fail_count = int(np.count_nonzero(failed))
+            summaries[chart_type] = {
+                "pass": len(self) - fail_count,
+                "fail": fail_count,
+                "total": len(self),
+            }
+        return summaries
+
+    def org_summaries(self, charts):
+        """Counts each claimed domain as passing an organization's chart only if
+        every one of the chart's scan types passed.
+
+        :param dict charts: Scan types making up each chart.
+        :return: pass/fail/total for each chart, keyed by organization _id, for
+            every organization with at least one claim.
+        :rtype: dict
+        """
+        claim_domains = np.frombuffer(self.claim_domains, dtype=np.int64)
+        claim_orgs = np.frombuffer(self.claim_orgs, dtype=np.int64)
+        org_count = len(self.org_ids)
+
+        totals = np.bincount(claim_orgs, minlength=org_count).tolist()
+        summaries = {org_id: {} for org_id in self.org_ids}
+        for chart_type, scan_types in charts.items():
+            passed = np.ones(len(self), dtype=bool)
+            for scan_type in scan_types:
+                passed &= self.column(scan_type) == PASS
+            pass_counts = np.bincount(
+                claim_orgs, weights=passed[claim_domains], minlength=org_count
+            )
+            for org, pass_count in enumerate(pass_counts.astype(np.int64).tolist()):
+                summaries[self.org_ids[org]][chart_type] = {
+                    "pass": pass_count,
+                    "fail": totals[org] - pass_count,
+                    "total": totals[org],
+                }
+        return summaries
+
+    def snapshots(self):
+        """Yields what each domain was counted as: its statuses and claiming organizations.
+
+        :return: A generator of documents keyed by the domain's _key.
+        :rtype: generator
+        """
+        claim_domains = np.frombuffer(self.claim_domains, dtype=np.int64)
+        claim_orgs = np.frombuffer(self.claim_orgs, dtype=np.int64)
+        order = np.argsort(claim_domains, kind="stable")
+        rows = np.arange(len(self))
+        starts = np.searchsorted(claim_domains[order], rows, side="left").tolist()
+        ends = np.searchsorted(claim_domains[order], rows, side="right").tolist()
+        sorted_orgs = claim_orgs[order].tolist()
+        columns = {scan_type: self.column(scan_type).tolist() for scan_type in self.scan_types}
+
+        for row, domain_id in enumerate(self.domain_ids):
+            status = {}
+            for scan_type in self.scan_types:
+                code = columns[scan_type][row]
+                if code != MISSING:
+                    status[scan_type] = self.values[scan_type][code]
+            yield {
+                "_key": domain_id.split("/", 1)[1],
+                "status": status,
+                "orgs": [self.org_ids[org] for org in sorted_orgs[starts[row]:ends[row]]],
+            }
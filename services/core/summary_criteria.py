@@ -0,0 +1,89 @@
+"""Summary criteria compiled into bitsets over guidance tag IDs.
+
+Every tag referenced by a set of criteria is given a bit, each criteria's pass
+and fail lists become a mask, and a domain's tags become a single int, so
+evaluating any number of criteria against a domain is a handful of bitwise
+operations.
+"""
+
+
+def tag_list(tags):
+    """Normalizes a criteria tag list; a lone string is one tag and empty IDs are ignored.
+
+    :param tags: A tag ID or list of tag IDs.
+    :return: The tag IDs.
+    :rtype: list
+    """
+    if tags is None:
+        return []
+    if isinstance(tags, str):
+        tags = [tags]
+    return [tag for tag in tags if tag]
+
+
+class SummaryCriteria:
+    """A compiled set of pass/fail criteria.
+
+    A domain fails a criteria if it has any of its fail tags, and passes if it
+    has every one of its pass tags and none of its fail tags. A criteria with
+    no pass tags is only passed by a domain with at least one of its tags, so
+    a domain that was never scanned doesn't pass. Otherwise it gets the
+    default result.
+
+    :param dict criteria: pass, fail, info and warning tag lists, keyed by summary type.
+    :param str default: Result for domains that neither pass nor fail.
+    """
+
+    def __init__(self, criteria, default=None):
+        self.default = default
+        self.bits = {}
+        self.masks = {}
+        for summary_type, summary_criteria in criteria.items():
+            pass_tags = tag_list(summary_criteria.get("pass"))
+            fail_tags = tag_list(summary_criteria.get("fail"))
+            other_tags = tag_list(summary_criteria.get("info")) + tag_list(
+                summary_criteria.get("warning")
+            )
+            for tag in pass_tags + fail_tags + other_tags:
+                self.bits.setdefault(tag, 1 << len(self.bits))
+            self.masks[summary_type] = (
+                self.tag_mask(pass_tags),
+                self.tag_mask(fail_tags),
+                self.tag_mask(pass_tags + fail_tags + other_tags),
+            )
+
+    @property
+    def tags(self):
+        """Every tag ID the criteria refer to.
+
+        :rtype: list
+        """
+        return list(self.bits)
+
+    def tag_mask(self, tags):
+        """Compiles tag IDs into a bitset; tags the criteria don't refer to are ignored.
+
+        :param list tags: Guidance tag IDs.
+        :rtype: int
+        """
+        mask = 0
+        for tag in tags:
+            mask |= self.bits.get(tag, 0)
+        return mask
+
+    def evaluate(self, mask):
+        """Evaluates every criteria against a domain's tags.
+
+        :param int mask: The domain's tags, as compiled by tag_mask.
+        :return: "pass", "fail" or the default result, keyed by summary type.
+        :rtype: dict
+        """
+        results = {}
+        for summary_type, (pass_mask, fail_mask, criteria_mask) in self.masks.items():
+            if mask & fail_mask:
+                results[summary_type] = "fail"
+            elif mask & pass_mask == pass_mask and mask & criteria_mask:
+                results[summary_type] = "pass"
+            else:
+                results[summary_type] = self.default
+        return results
@@ -0,0 +1,244 @@
+"""Generates a synthetic organizations/domains/claims graph for benchmarking core.
+
+Organization sizes follow a power law, so a few organizations claim most of
+the domains as in production, and a share of domains is claimed by a second
+organization. Every scan type's status is drawn from a configurable
+distribution. Keys are deterministic for a given seed, so a dataset can be
+regenerated exactly to compare runs.
+
+Usage::
+
+    python3 synthetic_data.py --domains 100000 --orgs 500 --truncate
+"""
+import os
+import sys
+import random
+import logging
+import argparse
+import datetime
+from database import get_db
+
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_HOST = os.getenv("DB_HOST")
+
+SCAN_TYPES = ["https", "ssl", "dkim", "spf", "dmarc"]
+ZONES = ["FED", "PROV", "MUNI"]
+SECTORS = ["DND", "TBS", "CSE", "HC", "ESDC", "CRA", "IRCC", "NRCAN"]
+DEFAULT_STATUS_DISTRIBUTION = {"pass": 0.6, "fail": 0.3, "info": 0.05}
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+
+def parse_distribution(text):
+    """Parses a status distribution such as "pass=0.6,fail=0.3,info=0.05".
+
+    Whatever probability is left over is the chance of a status being missing.
+
+    :param str text: Comma separated status=probability pairs.
+    :return: Probability of each status.
+    :rtype: dict
+    """
+    distribution = {}
+    for pair in text.split(","):
+        status, probability = pair.split("=")
+        distribution[status.strip()] = float(probability)
+    if sum(distribution.values()) > 1:
+        raise ValueError("Status probabilities add up to more than 1.")
+    return distribution
+
+
+def org_weights(org_count, skew):
+    """Relative sizes of organizations, largest first.
+
+    :param int org_count: Number of organizations.
+    :param float skew: Power law exponent, 0 makes every organization the same size.
+    :return: Cumulative weights for random.choices.
+    :rtype: list
+    """
+    cumulative = []
+    total = 0.0
+    for rank in range(org_count):
+        total = total + 1 / (rank + 1) ** skew
+        cumulative.append(total)
+    return cumulative
+
+
+def draw_status(rng, distribution):
+    status = {}
+    for scan_type in SCAN_TYPES:
+        roll = rng.random()
+        for value, probability in distribution.items():
+            if roll < probability:
+                status[scan_type] = value
+                break
+            roll = roll - probability
+    return status
+
+
+def generate_organizations(rng, org_count):
+    for org in range(org_count):
+        zone = rng.choice(ZONES)
+        sector = rng.choice(SECTORS)
+        details = {
+            "name": f"Synthetic Organization {org}",
+            "acronym": f"SO{org}",
+            "zone": zone,
+            "sector": sector,
+        }
+        yield {
+            "_key": f"synthetic-org-{org}",
+            "orgDetails": {"en": details, "fr": details},
+            "summaries": {
+                "web": {"pass": 0, "fail": 0, "total": 0},
+                "mail": {"pass": 0, "fail": 0, "total": 0},
+            },
+        }
+
+
+def generate_domains(rng, domain_count, distribution):
+    now = datetime.datetime.utcnow()
+    for domain in range(domain_count):
+        yield {
+            "_key": f"synthetic-domain-{domain}",
+            "domain": f"domain{domain}.synthetic.gc.ca",
+            "selectors": ["selector1"],
+            "status": draw_status(rng, distribution),
+            "lastRan": str(now - datetime.timedelta(minutes=rng.randrange(60 * 24 * 7))),
+        }
+
+
+def generate_claims(rng, domain_count, org_count, skew, shared_claims):
+    orgs = range(org_count)
+    cumulative = org_weights(org_count, skew)
+    for domain in range(domain_count):
+        owners = rng.choices(orgs, cum_weights=cumulative)
+        # Some domains are also claimed by a second, different organization
+        if org_count > 1 and rng.random() < shared_claims:
+            owners.append((owners[0] + 1 + rng.randrange(org_count - 1)) % org_count)
+        for owner in owners:
+            yield {
+                "_key": f"synthetic-claim-{domain}-{owner}",
+                "_from": f"organizations/synthetic-org-{owner}",
+                "_to": f"domains/synthetic-domain-{domain}",
+            }
+
+
+def import_batches(collection, documents, batch_size):
+    count = 0
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            collection.import_bulk(batch, on_duplicate="replace")
+            count = count + len(batch)
+            batch = []
+    if batch:
+        collection.import_bulk(batch, on_duplicate="replace")
+        count = count + len(batch)
+    return count
+
+
+def generate(
+    db,
+    domain_count,
+    org_count,
+    skew=1.0,
+    shared_claims=0.05,
+    distribution=DEFAULT_STATUS_DISTRIBUTION,
+    seed=0,
+    batch_size=10000,
+    truncate=False,
+):
+    """Writes a synthetic dataset to the organizations, domains and claims collections.
+
+    :param db: The database to write to.
+    :param int domain_count: Number of domains.
+    :param int org_count: Number of organizations.
+    :param float skew: Power law exponent of organization sizes.
+    :param float shared_claims: Share of domains claimed by two organizations.
+    :param dict distribution: Probability of each status, per scan type.
+    :param int seed: Random seed.
+    :param int batch_size: Documents per bulk import.
+    :param bool truncate: Empty the collections first.
+    :return: Number of documents written to each collection.
+    :rtype: dict
+    """
+    for name, edge in [("organizations", False), ("domains", False), ("claims", True)]:
+        if not db.has_collection(name):
+            db.create_collection(name, edge=edge)
+        elif truncate:
+            db.collection(name).truncate()
+
+    # Each collection gets its own generator so a dataset's domains don't
+    # depend on how many organizations it has
+    written = {
+        "organizations": import_batches(
+            db.collection("organizations"),
+            generate_organizations(random.Random(f"{seed}-organizations"), org_count),
+            batch_size,
+        ),
+        "domains": import_batches(
+            db.collection("domains"),
+            generate_domains(random.Random(f"{seed}-domains"), domain_count, distribution),
+            batch_size,
+        ),
+        "claims": import_batches(
+            db.collection("claims"),
+            generate_claims(
+                random.Random(f"{seed}-claims"),
+                domain_count,
+                org_count,
+                skew,
+                shared_claims,
+            ),
+            batch_size,
+        ),
+    }
+    return written
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--domains", type=int, default=1000, help="Number of domains.")
+    parser.add_argument("--orgs", type=int, default=50, help="Number of organizations.")
+    parser.add_argument(
+        "--skew", type=float, default=1.0, help="Power law exponent of organization sizes."
+    )
+    parser.add_argument(
+        "--shared-claims",
+        type=float,
+        default=0.05,
+        help="Share of domains claimed by a second organization.",
+    )
+    parser.add_argument(
+        "--status",
+        type=parse_distribution,
+        default=DEFAULT_STATUS_DISTRIBUTION,
+        help='Status distribution per scan type, e.g. "pass=0.6,fail=0.3,info=0.05".',
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Documents per bulk import.")
+    parser.add_argument(
+        "--truncate", action="store_true", help="Empty the collections before writing."
+    )
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    db = get_db(DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS)
+    written = generate(
+        db,
+        args.domains,
+        args.orgs,
+        skew=args.skew,
+        shared_claims=args.shared_claims,
+        distribution=args.status,
+        seed=args.seed,
+        batch_size=args.batch_size,
+        truncate=args.truncate,
+    )
+    logging.info(f"Synthetic dataset written: {written}")
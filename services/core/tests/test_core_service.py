@@ -219,6 +219,41 @@ def test_update_guidance():
         }
 
 
+def test_update_guidance_skips_unchanged():
+    test_guidance = [
+        {"file": "scanSummaryCriteria.json", "guidance": scan_summary_criteria_data},
+        {"file": "chartSummaryCriteria.json", "guidance": chart_summary_criteria_data},
+        {"file": "tags_dkim.json", "guidance": dkim_tag_data},
+        # Files core doesn't recognise are skipped
+        {"file": "notes.json", "guidance": {"note": "not guidance"}},
+    ]
+    writes = update_guidance(
+        test_guidance, host="testdb", name="test", user="", password="", port=8529
+    )
+
+    assert writes == {
+        "inserted": 0,
+        "updated": 0,
+        "skipped": len(scan_summary_criteria_data)
+        + len(chart_summary_criteria_data)
+        + len(dkim_tag_data),
+    }
+
+
+def test_sync_guidance_collection_raises_on_failed_write():
+    count = db.collection("dkimGuidanceTags").count()
+
+    # Slashes aren't allowed in document keys
+    with pytest.raises(ArangoServerError):
+        sync_guidance_collection(
+            db,
+            "dkimGuidanceTags",
+            [{"_key": "dkim/invalid", "tagName": "invalid", "guidance": "invalid"}],
+        )
+
+    assert db.collection("dkimGuidanceTags").count() == count
+
+
 def test_update_scan_summaries():
     update_scan_summaries(host="testdb", name="test", user="", password="", port=8529)
 
@@ -305,3 +340,484 @@ def test_update_org_summaries():
         "web": {"pass": 2, "fail": 1, "total": 3},
         "mail": {"pass": 1, "fail": 2, "total": 3},
     }
+
+
+def test_update_org_summaries_skips_unchanged():
+    written = update_org_summaries(
+        host="testdb", name="test", user="", password="", port=8529
+    )
+
+    assert written == 0
+
+
+def test_write_org_summaries_raises_on_failed_write():
+    with pytest.raises(ArangoServerError):
+        write_org_summaries(
+            db, [{"_id": "organizations/missing", "summaries": {"web": {}, "mail": {}}}]
+        )
+
+
+def test_update_summaries():
+    db.collection("scanSummaries").truncate()
+    db.collection("chartSummaries").truncate()
+    db.collection("organizations").update_match(
+        {"_key": "testorg"}, {"summaries": {"web": {}, "mail": {}}}, merge=False
+    )
+
+    update_summaries(host="testdb", name="test", user="", password="", port=8529)
+
+    for scan_type in ["https", "ssl", "dmarc", "spf"]:
+        summary = db.collection("scanSummaries").get({"_key": scan_type})
+        assert {k: summary[k] for k in ["pass", "fail", "total"]} == {
+            "pass": 2,
+            "fail": 1,
+            "total": 3,
+        }
+
+    dkimScanSummary = db.collection("scanSummaries").get({"_key": "dkim"})
+    assert {k: dkimScanSummary[k] for k in ["pass", "fail", "total"]} == {
+        "pass": 1,
+        "fail": 2,
+        "total": 3,
+    }
+
+    webSummary = db.collection("chartSummaries").get({"_key": "web"})
+    assert {k: webSummary[k] for k in ["pass", "fail", "total"]} == {
+        "pass": 2,
+        "fail": 1,
+        "total": 3,
+    }
+
+    mailSummary = db.collection("chartSummaries").get({"_key": "mail"})
+    assert {k: mailSummary[k] for k in ["pass", "fail", "total"]} == {
+        "pass": 1,
+        "fail": 2,
+        "total": 3,
+    }
+
+    organization = db.collection("organizations").get({"_key": "testorg"})
+    assert organization["summaries"] == {
+        "web": {"pass": 2, "fail": 1, "total": 3},
+        "mail": {"pass": 1, "fail": 2, "total": 3},
+    }
+
+    for key in ["zone-FED", "sector-DND"]:
+        rollup = db.collection("summaryRollups").get({"_key": key})
+        assert rollup["organizations"] == 1
+        assert rollup["summaries"] == organization["summaries"]
+
+    # Without incremental runs there are no snapshots to keep up to date
+    assert get_core_state(db, "summaries") is None
+
+
+def test_update_summaries_incremental():
+    update_summaries(
+        host="testdb", name="test", user="", password="", port=8529, write_snapshots=True
+    )
+
+    db.collection("domains").update(
+        {"_key": domain3["_key"], "status": {"https": "pass", "ssl": "pass"}}
+    )
+
+    update_summaries_incremental(
+        host="testdb", name="test", user="", password="", port=8529
+    )
+
+    httpsScanSummary = db.collection("scanSummaries").get({"_key": "https"})
+    assert {k: httpsScanSummary[k] for k in ["pass", "fail", "total"]} == {
+        "pass": 3,
+        "fail": 0,
+        "total": 3,
+    }
+
+    webSummary = db.collection("chartSummaries").get({"_key": "web"})
+    assert {k: webSummary[k] for k in ["pass", "fail", "total"]} == {
+        "pass": 3,
+        "fail": 0,
+        "total": 3,
+    }
+
+    organization = db.collection("organizations").get({"_key": "testorg"})
+    assert organization["summaries"] == {
+        "web": {"pass": 3, "fail": 0, "total": 3},
+        "mail": {"pass": 1, "fail": 2, "total": 3},
+    }
+
+    db.collection("domains").update(
+        {"_key": domain3["_key"], "status": {"https": "fail", "ssl": "fail"}}
+    )
+
+    update_summaries_incremental(
+        host="testdb", name="test", user="", password="", port=8529
+    )
+
+    organization = db.collection("organizations").get({"_key": "testorg"})
+    assert organization["summaries"] == {
+        "web": {"pass": 2, "fail": 1, "total": 3},
+        "mail": {"pass": 1, "fail": 2, "total": 3},
+    }
+
+
+def test_load_guidance():
+    guidance_path = os.path.join(
+        os.path.dirname(__file__), "..", "..", "..", "guidance"
+    )
+
+    guidance, version = load_guidance(guidance_path)
+
+    assert [entry["file"] for entry in guidance] == sorted(
+        file_name for file_name in os.listdir(guidance_path) if file_name.endswith(".json")
+    )
+    for entry in guidance:
+        with open(os.path.join(guidance_path, entry["file"])) as f:
+            assert entry["guidance"] == json.load(f)
+
+    assert load_guidance(guidance_path)[1] == version
+
+
+def test_sync_guidance_skips_unchanged_version(tmp_path):
+    with open(tmp_path / "chartSummaryCriteria.json", "w") as f:
+        json.dump(chart_summary_criteria_data, f)
+    with open(tmp_path / "tags_dkim.json", "w") as f:
+        json.dump(dkim_tag_data, f)
+
+    writes = sync_guidance(
+        host="testdb",
+        name="test",
+        user="",
+        password="",
+        port=8529,
+        source="local",
+        path=str(tmp_path),
+    )
+    assert writes is not None
+
+    revisions = {
+        collection: db.collection(collection).revision()
+        for collection in ["chartSummaryCriteria", "dkimGuidanceTags", "coreState"]
+    }
+    writes = sync_guidance(
+        host="testdb",
+        name="test",
+        user="",
+        password="",
+        port=8529,
+        source="local",
+        path=str(tmp_path),
+    )
+
+    assert writes is None
+    assert {
+        collection: db.collection(collection).revision() for collection in revisions
+    } == revisions
+
+
+def test_sync_guidance_keeps_version_after_failed_write(tmp_path):
+    state = get_core_state(db, "guidance")
+    with open(tmp_path / "tags_dkim.json", "w") as f:
+        json.dump(
+            {
+                **dkim_tag_data,
+                "dkim/invalid": {"tagName": "invalid", "guidance": "invalid"},
+            },
+            f,
+        )
+
+    with pytest.raises(ArangoServerError):
+        sync_guidance(
+            host="testdb",
+            name="test",
+            user="",
+            password="",
+            port=8529,
+            source="local",
+            path=str(tmp_path),
+        )
+
+    assert get_core_state(db, "guidance") == state
+
+
+def test_get_db_reuses_pooled_client():
+    first = get_db("testdb", 8529, "test", "", "")
+    second = get_db("testdb", 8529, "test", "", "")
+
+    assert first is second
+    assert first.has_collection("domains")
+
+
+def test_run_stages():
+    order = []
+
+    def stage(name):
+        def run():
+            order.append(name)
+            return name
+
+        return run
+
+    def failing_stage():
+        raise RuntimeError("stage failed")
+
+    results = run_stages(
+        {
+            "first": (stage("first"), []),
+            "second": (stage("second"), ["first"]),
+            "independent": (stage("independent"), []),
+            "failing": (failing_stage, []),
+            "after_failing": (stage("after_failing"), ["failing"]),
+        },
+        workers=2,
+    )
+
+    assert order.index("first") < order.index("second")
+    assert "after_failing" not in order
+    assert results["second"]["status"] == "completed"
+    assert results["second"]["result"] == "second"
+    assert results["independent"]["status"] == "completed"
+    assert results["failing"]["status"] == "failed"
+    assert results["after_failing"]["status"] == "skipped"
+
+    # Skips cascade even when a stage is listed before the stage it depends on
+    results = run_stages(
+        {
+            "a": (failing_stage, []),
+            "c": (stage("c"), ["b"]),
+            "b": (stage("b"), ["a"]),
+        }
+    )
+
+    assert [results[name]["status"] for name in ["a", "c", "b"]] == [
+        "failed",
+        "skipped",
+        "skipped",
+    ]
+
+
+def test_update_summary_partition():
+    db.collection("scanSummaries").truncate()
+    db.collection("chartSummaries").truncate()
+
+    merged = update_summary_partition(
+        host="testdb",
+        name="test",
+        user="",
+        password="",
+        port=8529,
+        partition=0,
+        partition_count=2,
+        run_id="testrun",
+    )
+    assert merged is False
+
+    merged = update_summary_partition(
+        host="testdb",
+        name="test",
+        user="",
+        password="",
+        port=8529,
+        partition=1,
+        partition_count=2,
+        run_id="testrun",
+    )
+    assert merged is True
+
+    dkimScanSummary = db.collection("scanSummaries").get({"_key": "dkim"})
+    assert {k: dkimScanSummary[k] for k in ["pass", "fail", "total"]} == {
+        "pass": 1,
+        "fail": 2,
+        "total": 3,
+    }
+
+    mailSummary = db.collection("chartSummaries").get({"_key": "mail"})
+    assert {k: mailSummary[k] for k in ["pass", "fail", "total"]} == {
+        "pass": 1,
+        "fail": 2,
+        "total": 3,
+    }
+
+    organization = db.collection("organizations").get({"_key": "testorg"})
+    assert organization["summaries"] == {
+        "web": {"pass": 2, "fail": 1, "total": 3},
+        "mail": {"pass": 1, "fail": 2, "total": 3},
+    }
+    assert db.collection("summaryPartials").count() == 0
+
+
+def test_run_summaries_records_history_after_merge(monkeypatch):
+    import core
+
+    recorded = []
+    monkeypatch.setattr(core, "record_summary_history", lambda: recorded.append(True))
+
+    monkeypatch.setattr(core, "update_summary_partition", lambda **kwargs: False)
+    assert run_summaries(partition_count=2) is False
+    assert recorded == []
+
+    monkeypatch.setattr(core, "update_summary_partition", lambda **kwargs: True)
+    assert run_summaries(partition_count=2) is True
+    assert recorded == [True]
+
+
+def test_record_summary_history():
+    update_summaries(host="testdb", name="test", user="", password="", port=8529)
+
+    retention = {"run": 7, "day": 90, "week": 730, "month": 0}
+    old = datetime.datetime(2020, 1, 15, 12, 0, 0)
+    now = datetime.datetime(2020, 6, 17, 12, 0, 0)
+    for recorded_at in [old, now]:
+        record_summary_history(
+            host="testdb",
+            name="test",
+            user="",
+            password="",
+            port=8529,
+            retention=retention,
+            recorded_at=recorded_at,
+        )
+
+    cursor = db.aql.execute(
+        """
+        FOR entry IN summaryHistory
+          FILTER entry.subject == "organizations/testorg" AND entry.chart == "mail"
+          SORT entry.resolution, entry.time
+          RETURN [entry.resolution, entry.time, entry.pass, entry.fail, entry.total]
+        """
+    )
+    # The old run and day entries expired, its week and month are kept
+    assert list(cursor) == [
+        ["day", "2020-06-17", 1, 2, 3],
+        ["month", "2020-01-01", 1, 2, 3],
+        ["month", "2020-06-01", 1, 2, 3],
+        ["run", "2020-06-17T12:00:00", 1, 2, 3],
+        ["week", "2020-01-13", 1, 2, 3],
+        ["week", "2020-06-15", 1, 2, 3],
+    ]
+
+
+def test_summary_watermark():
+    db_args = dict(host="testdb", name="test", user="", password="", port=8529)
+
+    unchanged, watermark = check_summary_watermark(**db_args)
+    save_summary_watermark(watermark, **db_args)
+    unchanged, watermark = check_summary_watermark(**db_args)
+    assert unchanged
+
+    db.collection("domains").update({"_key": domain1["_key"], "lastRan": "now"})
+    unchanged, watermark = check_summary_watermark(**db_args)
+    assert not unchanged
+
+
+def test_update_summaries_resumes_checkpoint():
+    # A checkpoint left by an interrupted attempt of the same run, which got
+    # as far as computing the summaries
+    summaries = {
+        "web": {"pass": 3, "fail": 0, "total": 3},
+        "mail": {"pass": 3, "fail": 0, "total": 3},
+    }
+    checkpoint = {
+        "run": "core-job-1",
+        "summarizedAt": str(datetime.datetime.utcnow()),
+        "scanSummaries": {},
+        "chartSummaries": {},
+        "orgSummaries": {org["_id"]: summaries},
+        "lastOrgKey": "",
+        "rollups": {},
+    }
+    set_core_state(db, "summaryCheckpoint", checkpoint)
+
+    update_summaries(
+        host="testdb",
+        name="test",
+        user="",
+        password="",
+        port=8529,
+        run_id="core-job-1",
+    )
+
+    organization = db.collection("organizations").get({"_key": "testorg"})
+    assert organization["summaries"] == summaries
+    assert get_core_state(db, "summaryCheckpoint") is None
+
+    # A checkpoint older than the full recompute interval isn't resumed
+    set_core_state(
+        db,
+        "summaryCheckpoint",
+        {**checkpoint, "summarizedAt": "2020-06-17 12:00:00"},
+    )
+    update_summaries(
+        host="testdb",
+        name="test",
+        user="",
+        password="",
+        port=8529,
+        run_id="core-job-1",
+    )
+    organization = db.collection("organizations").get({"_key": "testorg"})
+    assert organization["summaries"] != summaries
+
+    # A different run recomputes from scratch
+    update_summaries(
+        host="testdb",
+        name="test",
+        user="",
+        password="",
+        port=8529,
+        run_id="core-job-2",
+    )
+    organization = db.collection("organizations").get({"_key": "testorg"})
+    assert organization["summaries"] == {
+        "web": {"pass": 2, "fail": 1, "total": 3},
+        "mail": {"pass": 1, "fail": 2, "total": 3},
+    }
+
+
+def test_update_criteria_summaries():
+    # The tags query traverses every scan type, so each collection must exist
+    for collection in ["https", "ssl", "dmarc", "spf", "dkim", "dkimResults"]:
+        if not db.has_collection(collection):
+            db.create_collection(collection)
+    for edge_collection in [
+        "domainsHTTPS",
+        "domainsSSL",
+        "domainsDMARC",
+        "domainsSPF",
+        "domainsDKIM",
+        "dkimToDkimResults",
+    ]:
+        if not db.has_collection(edge_collection):
+            db.create_collection(edge_collection, edge=True)
+
+    # Only each domain's latest scan counts
+    old_https = db.collection("https").insert(
+        {"timestamp": "2021-01-01 12:00:00", "negativeTags": ["https3"]}
+    )
+    https1 = db.collection("https").insert(
+        {"timestamp": "2021-01-02 12:00:00", "negativeTags": ["https2"]}
+    )
+    ssl1 = db.collection("ssl").insert(
+        {"timestamp": "2021-01-02 12:00:00", "positiveTags": ["ssl5"]}
+    )
+    ssl2 = db.collection("ssl").insert(
+        {"timestamp": "2021-01-02 12:00:00", "positiveTags": ["ssl5"]}
+    )
+    db.collection("domainsHTTPS").insert({"_from": domain1["_id"], "_to": https1["_id"]})
+    db.collection("domainsHTTPS").insert({"_from": domain2["_id"], "_to": old_https["_id"]})
+    db.collection("domainsSSL").insert({"_from": domain1["_id"], "_to": ssl1["_id"]})
+    db.collection("domainsSSL").insert({"_from": domain2["_id"], "_to": ssl2["_id"]})
+    newer_https = db.collection("https").insert(
+        {"timestamp": "2021-01-03 12:00:00", "neutralTags": ["https1"]}
+    )
+    db.collection("domainsHTTPS").insert({"_from": domain2["_id"], "_to": newer_https["_id"]})
+
+    update_criteria_summaries(host="testdb", name="test", user="", password="", port=8529)
+
+    def counts(collection, key):
+        summary = db.collection(collection).get({"_key": key})
+        return {k: summary[k] for k in ["pass", "fail", "total"]}
+
+    # Scan summaries leave out domains matching neither list, charts count
+    # them as failing
+    assert counts("scanSummaries", "https") == {"pass": 1, "fail": 1, "total": 3}
+    assert counts("scanSummaries", "ssl") == {"pass": 2, "fail": 0, "total": 3}
+    assert counts("chartSummaries", "web") == {"pass": 1, "fail": 2, "total": 3}
+    assert counts("chartSummaries", "mail") == {"pass": 0, "fail": 3, "total": 3}
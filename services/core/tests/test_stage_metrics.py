@@ -0,0 +1,45 @@
+from stage_metrics import (
+    StageMetrics,
+    record,
+    record_request,
+    counted,
+    prometheus_text,
+    write_prometheus_textfile,
+)
+
+
+def test_stage_metrics_attributes_counts_to_running_stage():
+    metrics = StageMetrics("summaries")
+
+    def stage():
+        record_request("POST", "http://testdb:8529/_api/cursor", 120, 480)
+        read = list(counted(iter([{"_key": "1"}, {"_key": "2"}])))
+        record("docs_written", 3)
+        return len(read)
+
+    assert metrics.run(stage) == 2
+    # Nothing is recorded once the stage has finished
+    record("docs_written", 5)
+
+    assert metrics.counters == {
+        "db_requests": 1,
+        "bytes_sent": 120,
+        "bytes_received": 480,
+        "docs_read": 2,
+        "docs_written": 3,
+    }
+    assert metrics.wall_time >= 0
+    assert metrics.peak_rss_bytes > 0
+
+
+def test_write_prometheus_textfile(tmp_path):
+    metrics = StageMetrics("guidance")
+    metrics.run(lambda: record("docs_written", 4))
+
+    path = tmp_path / "core.prom"
+    write_prometheus_textfile([metrics], str(path))
+
+    text = path.read_text()
+    assert text == prometheus_text([metrics])
+    assert '# TYPE core_stage_docs_written gauge\ncore_stage_docs_written{stage="guidance"} 4\n' in text
+    assert "traced_peak_bytes{" not in text
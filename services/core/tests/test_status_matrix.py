@@ -0,0 +1,69 @@
+import pytest
+from status_matrix import StatusMatrix
+
+charts = {"mail": ["dmarc", "spf", "dkim"], "web": ["https", "ssl"]}
+
+
+@pytest.fixture
+def matrix():
+    matrix = StatusMatrix(["https", "ssl", "dkim", "spf", "dmarc"])
+    matrix.add_domain(
+        "domains/1",
+        {"https": "pass", "ssl": "pass", "dmarc": "pass", "spf": "pass", "dkim": "fail"},
+    )
+    matrix.add_domain(
+        "domains/2",
+        {"https": "pass", "ssl": "pass", "dmarc": "pass", "spf": "pass", "dkim": "pass"},
+    )
+    matrix.add_domain(
+        "domains/3",
+        {"https": "info", "ssl": "fail", "dmarc": "fail", "spf": "fail"},
+    )
+    matrix.add_claim("organizations/1", "domains/1")
+    matrix.add_claim("organizations/1", "domains/2")
+    matrix.add_claim("organizations/1", "domains/3")
+    matrix.add_claim("organizations/2", "domains/2")
+    return matrix
+
+
+def test_scan_summaries(matrix):
+    summaries = matrix.scan_summaries()
+
+    assert summaries["https"] == {"pass": 2, "fail": 0, "total": 3}
+    assert summaries["ssl"] == {"pass": 2, "fail": 1, "total": 3}
+    assert summaries["dkim"] == {"pass": 1, "fail": 1, "total": 3}
+
+
+def test_chart_summaries(matrix):
+    assert matrix.chart_summaries(charts) == {
+        "mail": {"pass": 1, "fail": 2, "total": 3},
+        "web": {"pass": 2, "fail": 1, "total": 3},
+    }
+
+
+def test_org_summaries(matrix):
+    assert matrix.org_summaries(charts) == {
+        "organizations/1": {
+            "mail": {"pass": 1, "fail": 2, "total": 3},
+            "web": {"pass": 2, "fail": 1, "total": 3},
+        },
+        "organizations/2": {
+            "mail": {"pass": 1, "fail": 0, "total": 1},
+            "web": {"pass": 1, "fail": 0, "total": 1},
+        },
+    }
+
+
+def test_add_claim_ignores_unknown_domains(matrix):
+    assert matrix.add_claim("organizations/1", "domains/4") is False
+
+
+def test_snapshots(matrix):
+    snapshots = list(matrix.snapshots())
+
+    assert snapshots[2] == {
+        "_key": "3",
+        "status": {"https": "info", "ssl": "fail", "dmarc": "fail", "spf": "fail"},
+        "orgs": ["organizations/1"],
+    }
+    assert snapshots[1]["orgs"] == ["organizations/1", "organizations/2"]
@@ -0,0 +1,78 @@
+import pytest
+from pretend import stub
+from core import load_summary_criteria
+from summary_criteria import SummaryCriteria, tag_list
+from test_data import chart_summary_criteria_data, scan_summary_criteria_data
+
+
+def test_tag_list():
+    assert tag_list("spf12") == ["spf12"]
+    assert tag_list([""]) == []
+    assert tag_list(None) == []
+
+
+def test_chart_criteria():
+    criteria = SummaryCriteria(
+        {"web": chart_summary_criteria_data["webSummaryCriteria"]}, default="fail"
+    )
+
+    assert criteria.evaluate(criteria.tag_mask(["ssl5"])) == {"web": "pass"}
+    assert criteria.evaluate(criteria.tag_mask(["ssl5", "https2"])) == {"web": "fail"}
+    assert criteria.evaluate(criteria.tag_mask(["https1"])) == {"web": "fail"}
+
+
+def test_every_pass_tag_is_required():
+    criteria = SummaryCriteria(
+        {"mail": chart_summary_criteria_data["mailSummaryCriteria"]}, default="fail"
+    )
+
+    assert criteria.evaluate(criteria.tag_mask(["dmarc23", "dmarc10", "spf12"])) == {
+        "mail": "pass"
+    }
+    assert criteria.evaluate(criteria.tag_mask(["dmarc23", "spf12"])) == {
+        "mail": "fail"
+    }
+
+
+def test_scan_criteria():
+    criteria = SummaryCriteria(
+        {
+            "https": scan_summary_criteria_data["httpsScanSummaryCriteria"],
+            "ssl": scan_summary_criteria_data["sslScanSummaryCriteria"],
+            "spf": scan_summary_criteria_data["spfScanSummaryCriteria"],
+        }
+    )
+
+    assert criteria.evaluate(criteria.tag_mask(["https1", "spf12"])) == {
+        "https": "pass",
+        "ssl": None,
+        "spf": "pass",
+    }
+    assert criteria.evaluate(criteria.tag_mask(["https3", "ssl5", "ssl2"])) == {
+        "https": "fail",
+        "ssl": "fail",
+        "spf": None,
+    }
+    # A criteria without pass tags isn't passed by a domain with none of its tags
+    assert criteria.evaluate(criteria.tag_mask([])) == {
+        "https": None,
+        "ssl": None,
+        "spf": None,
+    }
+
+
+def test_load_summary_criteria_skips_unexpected_keys():
+    docs = [
+        {"_key": "webSummaryCriteria", **chart_summary_criteria_data["webSummaryCriteria"]},
+        {"_key": "webCriteria", "pass": ["https1"], "fail": []},
+    ]
+    db = stub(
+        has_collection=lambda name: True,
+        aql=stub(execute=lambda query, **kwargs: iter(docs)),
+    )
+
+    criteria = load_summary_criteria(
+        db, "chartSummaryCriteria", "SummaryCriteria", default="fail"
+    )
+
+    assert list(criteria.masks) == ["web"]
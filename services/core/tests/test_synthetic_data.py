@@ -0,0 +1,40 @@
+import random
+import pytest
+from synthetic_data import (
+    parse_distribution,
+    org_weights,
+    draw_status,
+    generate_claims,
+)
+
+
+def test_parse_distribution():
+    assert parse_distribution("pass=0.6, fail=0.3") == {"pass": 0.6, "fail": 0.3}
+    with pytest.raises(ValueError):
+        parse_distribution("pass=0.8,fail=0.3")
+
+
+def test_org_weights_are_skewed():
+    cumulative = org_weights(3, 1.0)
+    sizes = [cumulative[0], cumulative[1] - cumulative[0], cumulative[2] - cumulative[1]]
+    assert sizes == pytest.approx([1, 1 / 2, 1 / 3])
+    assert org_weights(3, 0) == [1, 2, 3]
+
+
+def test_draw_status_follows_distribution():
+    rng = random.Random(0)
+    statuses = [draw_status(rng, {"pass": 0.5, "fail": 0.5}) for _ in range(100)]
+    assert all(set(status.values()) <= {"pass", "fail"} for status in statuses)
+    assert all(len(status) == 5 for status in statuses)
+    assert draw_status(rng, {}) == {}
+
+
+def test_generate_claims_is_deterministic():
+    first = list(generate_claims(random.Random(1), 100, 10, 1.0, 0.5))
+    second = list(generate_claims(random.Random(1), 100, 10, 1.0, 0.5))
+    assert first == second
+    assert 100 < len(first) < 200
+    # A domain is never claimed twice by the same organization
+    assert len({(claim["_from"], claim["_to"]) for claim in first}) == len(first)
+    # Keys are stable so regenerating replaces claims instead of duplicating them
+    assert len({claim["_key"] for claim in first}) == len(first)
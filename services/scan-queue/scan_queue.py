@@ -35,7 +35,7 @@ default_queues = {"https": https_queue, "ssl": ssl_queue, "dns": dns_queue}
 def Server(process_name, queues=default_queues):
     """Flask app that adds incoming JSON scan requests to Redis queues to be dispatched later.
 
-    Routes are /https, /ssl and /dns.
+    Routes are /https, /ssl and /dns, plus /bulk for requests of several scan types at once.
 
     Needs a Redis server to function and RQ workers must be started for scans to be dispatched.
 
@@ -125,6 +125,65 @@ def Server(process_name, queues=default_queues):
             logging.error(f"Full traceback: {traceback.format_exc()}")
         return msg
 
+    @flask_app.route("/bulk", methods=["POST"])
+    def enqueue_bulk():
+        """Enqueues a list of scan requests received at /bulk, each with the
+        scan type it is for, e.g. [{"scan_type": "https", "payload": {...}}, ...]
+
+        The requests of every scan type are enqueued together with one Redis round trip.
+
+        :return: a message indicating whether the requests were enqueued successfully,
+            with status 400 if a request is invalid or 500 if enqueuing failed.
+        :rtype: str
+        """
+        logging.info("Bulk scan request received.")
+        dispatchers = {"https": dispatch_https, "ssl": dispatch_ssl, "dns": dispatch_dns}
+
+        # Every request is checked before any is enqueued
+        try:
+            scan_requests = request.get_json(force=True)
+            payloads = {}
+            for scan_request in scan_requests:
+                scan_type = scan_request["scan_type"]
+                if scan_type not in dispatchers:
+                    raise ValueError(f"Unknown scan type '{scan_type}'")
+                payloads.setdefault(scan_type, []).append(scan_request["payload"])
+        except Exception as e:
+            msg = f"Invalid bulk scan request: ({type(e).__name__}: {str(e)})"
+            logging.error(msg)
+            return msg, 400
+
+        # Every scan type's jobs are queued on one pipeline, so they're all
+        # enqueued in a single Redis round trip or none are
+        try:
+            if payloads:
+                queues = flask_app.config["queues"]
+                with queues[next(iter(payloads))].connection.pipeline() as pipe:
+                    for scan_type, scan_payloads in payloads.items():
+                        queues[scan_type].enqueue_many(
+                            [
+                                Queue.prepare_data(
+                                    dispatchers[scan_type],
+                                    args=(payload,),
+                                    retry=Retry(max=3),
+                                    timeout=86400,
+                                    result_ttl=86400,
+                                )
+                                for payload in scan_payloads
+                            ],
+                            pipeline=pipe,
+                        )
+                    pipe.execute()
+        except Exception as e:
+            msg = f"An unexpected error occurred while attempting to enqueue bulk scan request: ({type(e).__name__}: {str(e)})"
+            logging.error(msg)
+            logging.error(f"Full traceback: {traceback.format_exc()}")
+            return msg, 500
+
+        msg = f"{len(scan_requests)} scan requests enqueued."
+        logging.info(msg)
+        return msg
+
     return flask_app
 
 
@@ -2,11 +2,37 @@ import pytest
 from pretend import stub
 from scan_queue import Server, dispatch_dns, dispatch_https, dispatch_ssl
 
-test_queues = {
-    "https": stub(enqueue=lambda func, payload, retry, job_timeout, result_ttl: None),
-    "ssl": stub(enqueue=lambda func, payload, retry, job_timeout, result_ttl: None),
-    "dns": stub(enqueue=lambda func, payload, retry, job_timeout, result_ttl: None),
-}
+enqueued_many = []
+
+
+class PipelineStub:
+    """Holds jobs until executed, then adds them to enqueued_many, like a Redis pipeline."""
+
+    def __init__(self):
+        self.queued = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.queued = []
+
+    def execute(self):
+        enqueued_many.extend(self.queued)
+        self.queued = []
+
+
+def queue_stub(scan_type):
+    return stub(
+        enqueue=lambda func, payload, retry, job_timeout, result_ttl: None,
+        enqueue_many=lambda job_datas, pipeline: pipeline.queued.append(
+            (scan_type, job_datas)
+        ),
+        connection=stub(pipeline=PipelineStub),
+    )
+
+
+test_queues = {scan_type: queue_stub(scan_type) for scan_type in ["https", "ssl", "dns"]}
 
 
 @pytest.fixture
@@ -53,3 +79,60 @@ def test_enqueue_ssl(client):
     res = client.post("/ssl", json=test_payload)
 
     assert res.data.decode("utf-8") == "SSL scan request enqueued."
+
+
+def test_enqueue_bulk(client):
+    enqueued_many.clear()
+    test_payload = [
+        {"scan_type": "https", "payload": {"domain": "cyber.gc.ca"}},
+        {"scan_type": "ssl", "payload": {"domain": "cyber.gc.ca"}},
+        {"scan_type": "https", "payload": {"domain": "canada.ca"}},
+    ]
+
+    res = client.post("/bulk", json=test_payload)
+
+    assert res.status_code == 200
+    assert res.data.decode("utf-8") == "3 scan requests enqueued."
+    assert [(scan_type, len(job_datas)) for scan_type, job_datas in enqueued_many] == [
+        ("https", 2),
+        ("ssl", 1),
+    ]
+    assert enqueued_many[0][1][1].args == ({"domain": "canada.ca"},)
+
+
+def test_enqueue_bulk_rejects_unknown_scan_type(client):
+    enqueued_many.clear()
+    test_payload = [
+        {"scan_type": "https", "payload": {"domain": "cyber.gc.ca"}},
+        {"scan_type": "tls", "payload": {"domain": "cyber.gc.ca"}},
+    ]
+
+    res = client.post("/bulk", json=test_payload)
+
+    assert res.status_code == 400
+    assert "Unknown scan type 'tls'" in res.data.decode("utf-8")
+    assert enqueued_many == []
+
+
+def test_enqueue_bulk_enqueues_nothing_when_a_queue_fails():
+    enqueued_many.clear()
+
+    def fail(job_datas, pipeline):
+        raise ConnectionError("Redis is unavailable")
+
+    failing_queues = {
+        **test_queues,
+        "ssl": stub(enqueue_many=fail, connection=stub(pipeline=PipelineStub)),
+    }
+    with Server("test", queues=failing_queues).test_client() as failing_client:
+        res = failing_client.post(
+            "/bulk",
+            json=[
+                {"scan_type": "https", "payload": {"domain": "cyber.gc.ca"}},
+                {"scan_type": "ssl", "payload": {"domain": "cyber.gc.ca"}},
+            ],
+        )
+
+    assert res.status_code == 500
+    assert "Redis is unavailable" in res.data.decode("utf-8")
+    assert enqueued_many == []